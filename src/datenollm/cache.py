@@ -0,0 +1,322 @@
+# Key-value caches with TTL and LRU eviction, deduplication of concurrent calls
+#
+# Optional environment variables:
+# DATENOLLM_CACHE_DIR - Directory for on-disk cache stores (default: '.cache/datenollm')
+
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+try:
+    default_cache_dir = os.environ['DATENOLLM_CACHE_DIR']
+except KeyError:
+    default_cache_dir = '.cache/datenollm'
+
+
+def make_key(*parts):
+    """Returns a stable hash of JSON serializable key parts"""
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def json_size(value):
+    """Returns approximate memory size of value as length of its JSON"""
+    return len(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class MemoryCache:
+    """
+    In-process cache with TTL and LRU eviction
+
+    Besides the number of items, the cache may be limited by the total
+    size of values (max_bytes), estimated by sizeof function.
+    """
+    def __init__(self, max_size=1024, ttl=None, max_bytes=None,
+                 sizeof=json_size):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires, size = item
+                if expires is None or expires > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[2]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            logger.debug(f'Value is too large for cache: {size=}')
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, expires, size)
+            self.bytes += size
+            while len(self._data) > self.max_size or \
+                    (self.max_bytes and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'backend': 'memory',
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+
+class SQLiteCache:
+    """
+    On-disk cache with TTL and LRU eviction
+
+    Values must be JSON serializable. The SQLite store may be shared by
+    several worker processes.
+    """
+    def __init__(self, path=None, max_size=1024, ttl=None, table='cache'):
+        if not path:
+            path = os.path.join(default_cache_dir, 'cache.sqlite')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)')
+        self._conn.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed)')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT value, expires FROM {self.table} WHERE key=?',
+                (key,)).fetchone()
+            if row is not None:
+                value, expires = row
+                if expires is None or expires > now:
+                    self._conn.execute(
+                        f'UPDATE {self.table} SET accessed=? WHERE key=?',
+                        (now, key))
+                    self.hits += 1
+                    return json.loads(value)
+                self._conn.execute(f'DELETE FROM {self.table} WHERE key=?',
+                                   (key,))
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} '
+                '(key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), expires, now))
+            size = self._conn.execute(
+                f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+            if size > self.max_size:
+                evicted = self._conn.execute(
+                    f'DELETE FROM {self.table} WHERE key IN ('
+                    f'SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)',
+                    (size - self.max_size,)).rowcount
+                self.evictions += evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table} WHERE key=?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table}')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def stats(self):
+        size = len(self)
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'backend': 'sqlite',
+                'path': self.path,
+                'size': size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+
+def create_cache(backend='memory', path=None, max_size=1024, ttl=None,
+                 table='cache', max_bytes=None):
+    """
+    Creates cache for the given backend
+
+    Args:
+        backend (str): 'memory', 'sqlite' or 'none'
+        path (str): SQLite database path
+        max_size (int): Maximum number of cached items
+        ttl (float): Item time to live in seconds, None for no expiration
+        table (str): SQLite table name
+        max_bytes (int): Maximum total size of values in memory cache
+
+    Returns:
+        MemoryCache, SQLiteCache or None for 'none' backend
+    """
+    if not backend or backend == 'none':
+        return None
+    if backend == 'memory':
+        return MemoryCache(max_size=max_size, ttl=ttl, max_bytes=max_bytes)
+    if backend == 'sqlite':
+        return SQLiteCache(path=path, max_size=max_size, ttl=ttl, table=table)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplication of concurrent identical calls
+
+    While a call with some key is in flight, other calls with the same key
+    don't run their function, they wait for the first call and share its
+    result (or exception).
+    """
+    def __init__(self):
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Calls fn(*args, **kwargs) unless identical call is in flight"""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """Awaits fn(*args, **kwargs) unless identical call is in flight"""
+        loop = asyncio.get_running_loop()
+        # Tasks can't be shared between event loops
+        loop_key = (id(loop), key)
+        with self._lock:
+            self.calls += 1
+            task = self._async_calls.get(loop_key)
+            if task is None:
+                # The call runs in its own task, so cancellation of one
+                # caller (e.g. disconnected client) doesn't cancel others
+                task = asyncio.ensure_future(fn(*args, **kwargs))
+                self._async_calls[loop_key] = task
+                task.add_done_callback(
+                    functools.partial(self._async_done, loop_key))
+            else:
+                self.shared += 1
+        return await asyncio.shield(task)
+
+    def _async_done(self, loop_key, task):
+        with self._lock:
+            if self._async_calls.get(loop_key) is task:
+                del self._async_calls[loop_key]
+        if not task.cancelled():
+            # Mark exception as retrieved if nobody waits for it
+            task.exception()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                'in_flight': len(self._calls) + len(self._async_calls),
+            }
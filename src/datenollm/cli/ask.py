@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
+import sys
 
 from datenollm.client import DatenoClient
+from datenollm.history import HistoryPolicy
+
+def read_batch(file_path):
+    """Read queries from JSONL file: JSON strings or objects with 'query' key"""
+    queries = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                queries.append(json.loads(line))
+    return queries
 
 def main():
     parser = argparse.ArgumentParser(
         description='Generate structured queries for Dateno from user input using LLM')
     parser.add_argument('addr',
                         help='Client address (e.g. http://127.0.0.1:7861/)')
-    parser.add_argument('query', help='Initial user request')
+    parser.add_argument('query', nargs='?', default=None,
+                        help='Initial user request')
     parser.add_argument('--history', type=str, required=False, default=None,
-                        help='Path to file containing dialog history in JSON format')
+                        help='Path to file containing dialog history in JSON format (.jsonl for append-only history)')
     parser.add_argument('--prompt', type=str, required=False, default=None,
                         help='Path to file containing system prompt')
     parser.add_argument('--model', type=str, required=False, default=None,
@@ -22,10 +36,52 @@ def main():
                         default=None, help='Generation temperature')
     parser.add_argument('--top-p', type=float, required=False,
                         default=None, help='Nucleus sampling parameter')
+    parser.add_argument('--history-turns', type=int, required=False,
+                        default=None, help='Send only the last N turns of history')
+    parser.add_argument('--history-tokens', type=int, required=False,
+                        default=None, help='Maximum estimated tokens of history sent')
+    parser.add_argument('--liked-only', action='store_true', default=None,
+                        help='Send only liked turns of history')
+    parser.add_argument('--stream', action='store_true',
+                        help='Print response while it is generated')
+    parser.add_argument('--batch', type=str, required=False, default=None,
+                        help='Path to JSONL file with queries, results are printed as JSONL')
+    parser.add_argument('--concurrency', type=int, required=False, default=4,
+                        help='Number of concurrent queries in batch mode')
+    parser.add_argument('--output', type=str, required=False, default=None,
+                        help='Path to JSONL file for batch results (default: stdout)')
     
     args = parser.parse_args()
+    if not args.query and not args.batch:
+        parser.error('query or --batch is required')
+
+    history_policy = HistoryPolicy.from_env().update(
+        args.history_turns, args.history_tokens, args.liked_only)
+    client = DatenoClient(args.addr, history_policy=history_policy)
+    if args.batch:
+        queries = read_batch(args.batch)
+        output = args.output if args.output else sys.stdout
+        client.ask_many(queries, args.concurrency, output, args.history,
+                        args.prompt, args.model, args.max_tokens,
+                        args.temperature, args.top_p)
+        return
+
+    if args.stream:
+        # Progress goes to stderr, stdout gets only the final response
+        # like in non-stream mode
+        printed = ''
+        result = ''
+        for result in client.ask_stream(args.query, args.history, args.prompt,
+                                        args.model, args.max_tokens,
+                                        args.temperature, args.top_p):
+            if result.startswith(printed):
+                # Print only the new part of accumulated response
+                print(result[len(printed):], end='', file=sys.stderr, flush=True)
+                printed = result
+        print(file=sys.stderr)
+        print(result)
+        return
 
-    client = DatenoClient(args.addr)
     result = client.ask(args.query, args.history, args.prompt, args.model,
                         args.max_tokens, args.temperature, args.top_p)
 
@@ -1,19 +1,39 @@
 #!/usr/bin/env python3
 
+import argparse
 import sys
 from langchain.schema import AIMessage, HumanMessage
 
-from datenollm.client import read_flagged_log_csv
+from datenollm.client import iter_flagged_log_messages, parse_timestamp
+
+def timestamp(value):
+    try:
+        return parse_timestamp(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 def main():
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <flagged_log_csv_file>", file=sys.stderr)
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Read and print Gradio's flagged logs")
+    parser.add_argument('file_path', help='Path to flagged log CSV file')
+    parser.add_argument('--since', type=timestamp, default=None,
+                        help='Print conversations flagged at or after this time (ISO format)')
+    parser.add_argument('--until', type=timestamp, default=None,
+                        help='Print conversations flagged before this time (ISO format)')
+    parser.add_argument('--flag', type=str, default=None,
+                        help="Print only conversations with this 'value' column")
+    parser.add_argument('--start-index', type=int, default=None,
+                        help="Print conversations with 'index' column starting from this value")
+    parser.add_argument('--stop-index', type=int, default=None,
+                        help="Print conversations with 'index' column below this value")
+    args = parser.parse_args()
 
-    file_path = sys.argv[1]
+    file_path = args.file_path
 
     try:
-        messages = read_flagged_log_csv(file_path)
+        messages = iter_flagged_log_messages(file_path, since=args.since,
+                                             until=args.until, flag=args.flag,
+                                             start_index=args.start_index,
+                                             stop_index=args.stop_index)
         for i, msg in enumerate(messages):
             if isinstance(msg, HumanMessage):
                 print('====================================')
@@ -31,6 +51,7 @@ def main():
         sys.exit(1)
     except Exception as e:
         print(f"An error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
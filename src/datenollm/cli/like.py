@@ -12,6 +12,8 @@ def main():
     parser.add_argument('index', type=int, help='Index of the log entry')
     parser.add_argument('flag', type=str, help='Flag to mark the log entry (like/dislike)')
     parser.add_argument('csv_path', type=str, help='Path to the flagged_log CSV file')
+    parser.add_argument('--by-index', action='store_true',
+                        help="Look up the log entry by 'index' column instead of row number")
     args = parser.parse_args()
 
     if args.flag.lower() == 'like':
@@ -22,7 +24,8 @@ def main():
         print("Invalid flag. Use 'like' or 'dislike'.", file=sys.stderr)
         sys.exit(1)
 
-    index, conversation = get_conversation_from_csv(args.csv_path, args.index)
+    index, conversation = get_conversation_from_csv(args.csv_path, args.index,
+                                                    args.by_index)
     if conversation is None:
         print(f"Conversation with index {args.index} not found in {args.csv_path}", file=sys.stderr)
         sys.exit(1)
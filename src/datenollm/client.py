@@ -1,12 +1,24 @@
+# Optional environment variables:
+# HF_TOKEN - Hugging Face token for private spaces
+# DATENOLLM_GRADIO_SCHEMA_CACHE - Cache fetched Gradio API config on disk (default: false)
+# DATENOLLM_GRADIO_SCHEMA_TTL - Cached Gradio API config time to live in seconds (default: 86400)
+
 import csv
 import json
 import os
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
 from gradio_client import Client
 from langchain.schema import AIMessage, HumanMessage
 
-from .file_utils import read_json_file, read_text_file, save_json_file
+from .cache import default_cache_dir, make_key
+from .file_utils import read_text_file
+from .history import HistoryPolicy, append_history, is_jsonl, load_history
+from .log_index import FlaggedLogIndex
 
 # Configure logging
 log_level = getattr(logging, os.environ.get('DATENOLLM_DEBUG', 'INFO').upper(), logging.INFO)
@@ -16,29 +28,137 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+schema_cache = os.environ.get('DATENOLLM_GRADIO_SCHEMA_CACHE', '').lower() in ('1', 'true', 'yes')
+try:
+    schema_cache_ttl = float(os.environ['DATENOLLM_GRADIO_SCHEMA_TTL'])
+except:
+    schema_cache_ttl = 86400
+schema_cache_dir = os.path.join(default_cache_dir, 'gradio')
+
+
+class CachedSchemaClient(Client):
+    """
+    Gradio client which keeps fetched API config and info in local cache
+
+    Saves the round-trips to the server on start of short-lived processes.
+    """
+    def _schema_path(self, name):
+        key = make_key(self.src, name)
+        return os.path.join(schema_cache_dir, f'{key}.json')
+
+    def _cached_schema(self, name, fetch):
+        path = self._schema_path(name)
+        try:
+            if time.time() - os.path.getmtime(path) < schema_cache_ttl:
+                with open(path, 'r', encoding='utf-8') as f:
+                    logger.debug(f'Gradio {name} loaded from {path}')
+                    return json.load(f)
+        except (OSError, ValueError):
+            pass
+        schema = fetch()
+        try:
+            os.makedirs(schema_cache_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(schema, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            logger.warning(f'Gradio {name} is not cached: {e}')
+        return schema
+
+    def _get_config(self):
+        return self._cached_schema('config', super()._get_config)
+
+    def _get_api_info(self):
+        return self._cached_schema('api_info', super()._get_api_info)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(client_addr, hf_token=None):
+    """Returns gradio client shared in process by (address, token)"""
+    key = (client_addr, hf_token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client_class = CachedSchemaClient if schema_cache else Client
+            client = client_class(client_addr, hf_token)
+            _clients[key] = client
+        return client
+
+
 class DatenoClient:
-    def __init__(self, client_addr, hf_token=None):
+    def __init__(self, client_addr, hf_token=None, history_policy=None):
         if not hf_token:
             hf_token=os.environ.get('HF_TOKEN')
-        self.client = Client(client_addr, hf_token)
+        self.client_addr = client_addr
+        self.hf_token = hf_token
+        self._client = None
+        if history_policy is None:
+            history_policy = HistoryPolicy.from_env()
+        # Selection of history turns sent with queries
+        self.history_policy = history_policy
 
-    def ask(self, query, history_path=None, prompt_path=None,
-            model=None, max_tokens=None, temperature=None, top_p=None):
+    @property
+    def client(self):
+        """Gradio client, connected on first use"""
+        if self._client is None:
+            self._client = get_client(self.client_addr, self.hf_token)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def _ask_params(self, history_path=None, prompt_path=None, model=None,
+                    max_tokens=None, temperature=None, top_p=None,
+                    context=None):
         params = {}
         if prompt_path:
             params['prompt'] = read_text_file(prompt_path)
         if model:
             params['model'] = model
-        if max_tokens:
+        if max_tokens is not None:
             params['max_tokens'] = max_tokens
-        if temperature:
+        if temperature is not None:
             params['temperature'] = temperature
-        if top_p:
+        if top_p is not None:
             params['top_p'] = top_p
 
+        history = []
         if history_path:
-            history = read_json_file(history_path)
-            params['history'] = history
+            policy = self.history_policy
+            if is_jsonl(history_path) and not policy.liked_only:
+                # New turns are appended, only the sent part is needed
+                history = load_history(history_path, policy.max_turns)
+            else:
+                history = load_history(history_path)
+        if history_path or context:
+            params['history'] = list(context or []) + \
+                self.history_policy.apply(history)
+
+        return params, history
+
+    def _save_history(self, history, query, result, history_path):
+        append_history(history_path, [
+            {'role': 'user', 'metadata': None, 'content': query, 'options': None},
+            {'role': 'assistant', 'metadata': None, 'content': result, 'options': None},
+        ], history=history)
+
+    def ask(self, query, history_path=None, prompt_path=None,
+            model=None, max_tokens=None, temperature=None, top_p=None,
+            context=None):
+        """
+        Send query to LLM
+
+        History from history_path is sent with the query and the new turn
+        is appended to it. Context messages are sent before the history
+        but are not saved.
+        """
+        params, history = self._ask_params(history_path, prompt_path, model,
+                                           max_tokens, temperature, top_p,
+                                           context)
 
         result = self.client.predict(
             message=query,
@@ -47,13 +167,123 @@ class DatenoClient:
         )
 
         if history_path:
-            history = params.get('history', [])
-            history.append({'role': 'user', 'metadata': None, 'content': query, 'options': None})
-            history.append({'role': 'assistant', 'metadata': None, 'content': result, 'options': None})
-            save_json_file(history, history_path)
+            self._save_history(history, query, result, history_path)
 
         return result
 
+    def ask_stream(self, query, history_path=None, prompt_path=None,
+                   model=None, max_tokens=None, temperature=None, top_p=None,
+                   context=None):
+        """
+        Streaming version of ask()
+
+        Yields the response accumulated so far as the server generates it.
+        History is saved after the final response is received.
+        """
+        params, history = self._ask_params(history_path, prompt_path, model,
+                                           max_tokens, temperature, top_p,
+                                           context)
+
+        job = self.client.submit(
+            message=query,
+            params=json.dumps(params),
+            api_name="/ask_stream"
+        )
+
+        result = None
+        for result in job:
+            yield result
+
+        # The last update may be skipped by iteration, take the final output
+        outputs = job.outputs()
+        if outputs and outputs[-1] != result:
+            result = outputs[-1]
+            yield result
+
+        if history_path and result is not None:
+            self._save_history(history, query, result, history_path)
+
+    def ask_many(self, queries, concurrency=4, output=None, history_path=None,
+                 prompt_path=None, model=None, max_tokens=None,
+                 temperature=None, top_p=None):
+        """
+        Send many queries concurrently over one client connection
+
+        Args:
+            queries (list): Query strings or dicts with 'query' key and
+                optional 'id', 'model', 'max_tokens', 'temperature', 'top_p'
+            concurrency (int): Maximum number of jobs in flight
+            output (str or file): JSONL file (path or file object) where
+                results are written as they complete
+            history_path (str): History used as read-only context of every query
+            prompt_path, model, max_tokens, temperature, top_p: Default
+                parameters of queries
+
+        Returns:
+            list: Results in the order of queries, dicts with 'index',
+            'query', 'result' and 'error' keys (and 'id' if given)
+        """
+        base_params, history = self._ask_params(history_path, prompt_path,
+                                                model, max_tokens,
+                                                temperature, top_p)
+
+        def ask_one(index, item):
+            record = {'index': index}
+            if isinstance(item, dict):
+                record['query'] = item.get('query')
+                if 'id' in item:
+                    record['id'] = item['id']
+            else:
+                record['query'] = item
+            try:
+                if isinstance(item, dict):
+                    query = item.get('query')
+                    if query is None:
+                        raise ValueError("Query item has no 'query' key")
+                    params = dict(base_params)
+                    # Falsy overrides like temperature 0 are valid
+                    for key in ('model', 'max_tokens', 'temperature', 'top_p'):
+                        if item.get(key) is not None:
+                            params[key] = item[key]
+                else:
+                    query = item
+                    params = base_params
+                record['result'] = self.client.predict(
+                    message=query,
+                    params=json.dumps(params),
+                    api_name="/ask"
+                )
+                record['error'] = None
+            except Exception as e:
+                logger.error(f"Query {index} failed: {e}")
+                record['result'] = None
+                record['error'] = str(e)
+            return record
+
+        close_output = False
+        if isinstance(output, str):
+            output = open(output, 'a', encoding='utf-8')
+            close_output = True
+        output_lock = threading.Lock()
+
+        results = [None] * len(queries)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                futures = [executor.submit(ask_one, index, item)
+                           for index, item in enumerate(queries)]
+                for future in as_completed(futures):
+                    record = future.result()
+                    results[record['index']] = record
+                    if output is not None:
+                        with output_lock:
+                            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                            output.flush()
+        finally:
+            if close_output:
+                output.close()
+
+        return results
+
     def get_logs(self):
         result = self.client.predict(
             api_name="/logs"
@@ -119,43 +349,187 @@ class DatenoFilter(DatenoClient):
         return result
 
 
-def read_flagged_log_csv(file_path):
+class FlaggedConversation:
     """
-    Reads the flagged log CSV file and returns a list of langchain HumanMessage and AIMessage objects.
-    Extra fields (like value, flag, etc) are placed in the 'kwargs' of the last AIMessage in each conversation.
+    Conversation from flagged log row
+
+    The conversation JSON is decoded only when messages or conversation
+    are accessed.
     """
-    history = []
-    with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
+    def __init__(self, row):
+        self.row = row
+        self._conversation = None
+
+    @property
+    def options(self):
+        """Extra fields of the row (like value, flag, etc)"""
+        options = {k: v for k, v in self.row.items() if k != 'conversation'}
+        # Move 'flag' to 'timestamp'
+        if 'flag' in options:
+            options['timestamp'] = options.pop('flag')
+        return options
+
+    @property
+    def index(self):
+        try:
+            return int(self.row.get('index'))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def timestamp(self):
+        """Row timestamp as datetime, None if it's missing or invalid"""
+        return _parse_datetime(self.options.get('timestamp'))
+
+    @property
+    def conversation(self):
+        """Decoded conversation: list of message dicts"""
+        if self._conversation is None:
             try:
-                conversation = json.loads(row.get('conversation', '[]'))
+                self._conversation = json.loads(self.row.get('conversation', '[]'))
             except json.JSONDecodeError:
-                conversation = []
-            for i, msg in enumerate(conversation):
-                msg_type = msg.get('role', '').lower()
-                if msg_type == 'user':
-                    history.append(HumanMessage(content=msg.get('content', '')))
-                elif msg_type == 'assistant' or msg_type == 'ai':
-                    if i == len(conversation) - 1:
-                        # Place extra fields in additional_kwargs for the last AI message
-                        options = {k: v for k, v in row.items() if k != 'conversation'}
-                        # Move 'flag' to 'timestamp'
-                        if 'flag' in options:
-                            options['timestamp'] = options.pop('flag')
-                        history.append(AIMessage(content=msg.get('content', ''), additional_kwargs=options if options else {}))
-                    else:
-                        history.append(AIMessage(content=msg.get('content', '')))
+                self._conversation = []
+        return self._conversation
+
+    @property
+    def messages(self):
+        """Conversation as langchain HumanMessage and AIMessage objects"""
+        messages = []
+        conversation = self.conversation
+        for i, msg in enumerate(conversation):
+            msg_type = msg.get('role', '').lower()
+            if msg_type == 'user':
+                messages.append(HumanMessage(content=msg.get('content', '')))
+            elif msg_type == 'assistant' or msg_type == 'ai':
+                if i == len(conversation) - 1:
+                    # Place extra fields in additional_kwargs for the last AI message
+                    options = self.options
+                    messages.append(AIMessage(content=msg.get('content', ''), additional_kwargs=options if options else {}))
                 else:
-                    # Unknown role, treat as HumanMessage for compatibility
-                    history.append(HumanMessage(content=msg.get('content', '')))
-    return history
+                    messages.append(AIMessage(content=msg.get('content', '')))
+            else:
+                # Unknown role, treat as HumanMessage for compatibility
+                messages.append(HumanMessage(content=msg.get('content', '')))
+        return messages
+
+
+def _naive_utc(value):
+    # Aware timestamps are compared as naive UTC, like the logged ones
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _fromisoformat(value):
+    value = str(value).strip()
+    # Python < 3.11 doesn't parse the 'Z' suffix
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    return _naive_utc(datetime.fromisoformat(value))
 
-def get_conversation_from_csv(file_path, index):
-    with open(file_path, 'r') as f:
+def _parse_datetime(value):
+    if value is None:
+        return value
+    if isinstance(value, datetime):
+        return _naive_utc(value)
+    try:
+        return _fromisoformat(value)
+    except ValueError:
+        return None
+
+def parse_timestamp(value):
+    """
+    Parses timestamp filter value (datetime or ISO format string)
+
+    Aware timestamps are converted to naive UTC.
+
+    Raises:
+        ValueError: If the value is not a valid timestamp
+    """
+    if value is None:
+        return value
+    if isinstance(value, datetime):
+        return _naive_utc(value)
+    try:
+        return _fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value!r}, ISO format expected "
+                         "(e.g. 2025-07-01 or 2025-07-01T12:00:00)")
+
+def iter_flagged_log(file_path, since=None, until=None, flag=None,
+                     start_index=None, stop_index=None):
+    """
+    Reads the flagged log CSV file one conversation at a time
+
+    Args:
+        file_path (str): Path to flagged log CSV file
+        since, until (datetime or str): Timestamp range, until is exclusive
+        flag (str): Keep only rows with this 'value' column (e.g. like flag)
+        start_index, stop_index (int): Range of 'index' column, stop is exclusive
+
+    Yields:
+        FlaggedConversation: Conversation with lazily decoded messages
+
+    Raises:
+        ValueError: If since or until is not a valid timestamp (on call,
+            before iteration)
+    """
+    # Invalid filters are reported right away, not on the first row
+    since = parse_timestamp(since)
+    until = parse_timestamp(until)
+    return _iter_flagged_log(file_path, since, until, flag,
+                             start_index, stop_index)
+
+def _iter_flagged_log(file_path, since, until, flag, start_index, stop_index):
+    with open(file_path, 'r', newline='') as f:
         reader = csv.DictReader(f)
-        for i, row in enumerate(reader):
-            if i == index:
-                index = int(row.get('index', None))
-                return index, json.loads(row.get('conversation', '[]'))
-    return None, None
+        for row in reader:
+            item = FlaggedConversation(row)
+            if flag is not None and str(row.get('value')) != str(flag):
+                continue
+            if start_index is not None or stop_index is not None:
+                index = item.index
+                if index is None:
+                    continue
+                if start_index is not None and index < start_index:
+                    continue
+                if stop_index is not None and index >= stop_index:
+                    continue
+            if since is not None or until is not None:
+                timestamp = item.timestamp
+                if timestamp is None:
+                    continue
+                if since is not None and timestamp < since:
+                    continue
+                if until is not None and timestamp >= until:
+                    continue
+            yield item
+
+def iter_flagged_log_messages(file_path, **filters):
+    """Yields langchain messages of flagged log conversations, see iter_flagged_log()"""
+    for item in iter_flagged_log(file_path, **filters):
+        for msg in item.messages:
+            yield msg
+
+def read_flagged_log_csv(file_path):
+    """
+    Reads the flagged log CSV file and returns a list of langchain HumanMessage and AIMessage objects.
+    Extra fields (like value, flag, etc) are placed in the 'kwargs' of the last AIMessage in each conversation.
+    """
+    return list(iter_flagged_log_messages(file_path))
+
+def get_conversation_from_csv(file_path, index, by_index_column=False):
+    """
+    Returns ('index' column value, conversation) of flagged log row
+
+    Row is looked up by its number or, with by_index_column, by the value
+    of 'index' column, using the sidecar offset index of the CSV file.
+    """
+    log_index = FlaggedLogIndex(file_path)
+    if by_index_column:
+        row = log_index.get_row_by_index(index)
+    else:
+        row = log_index.get_row(index)
+    if row is None:
+        return None, None
+    index = int(row.get('index', None))
+    return index, json.loads(row.get('conversation', '[]'))
@@ -1,37 +1,363 @@
 import os
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from contextlib import contextmanager
 import dateno.core
 
+from .cache import SingleFlight, create_cache, default_cache_dir, make_key
+
 DATENO_API_KEY = os.getenv('DATENO_API_KEY')
+# Maximum number of LLM queries searched in parallel
+try:
+    DATENO_SEARCH_WORKERS = int(os.getenv('DATENO_SEARCH_WORKERS', 8))
+except ValueError:
+    DATENO_SEARCH_WORKERS = 8
+# Per-query search timeout in seconds, counted from the query start
+try:
+    DATENO_SEARCH_TIMEOUT = float(os.getenv('DATENO_SEARCH_TIMEOUT', 60))
+except ValueError:
+    DATENO_SEARCH_TIMEOUT = 60
+# Maximum number of hits returned by iter_index_search
+try:
+    DATENO_SEARCH_MAX_HITS = int(os.getenv('DATENO_SEARCH_MAX_HITS', 10000))
+except ValueError:
+    DATENO_SEARCH_MAX_HITS = 10000
+# DatenoCmd debug output
+DATENO_DEBUG = os.getenv('DATENO_DEBUG', '').lower() in ('1', 'true', 'yes')
+# Maximum number of idle DatenoCmd sessions kept per API key
+try:
+    DATENO_SESSION_POOL_SIZE = int(os.getenv('DATENO_SESSION_POOL_SIZE', 8))
+except ValueError:
+    DATENO_SESSION_POOL_SIZE = 8
+
+# Search results cache backend: memory, sqlite or none
+DATENO_CACHE = os.getenv('DATENO_CACHE', 'memory').lower()
+DATENO_CACHE_PATH = os.getenv('DATENO_CACHE_PATH',
+                              os.path.join(default_cache_dir, 'dateno_cache.sqlite'))
+# Cached search results time to live in seconds
+try:
+    DATENO_CACHE_TTL = float(os.getenv('DATENO_CACHE_TTL', 600))
+except ValueError:
+    DATENO_CACHE_TTL = 600
+# Maximum number of cached search results
+try:
+    DATENO_CACHE_SIZE = int(os.getenv('DATENO_CACHE_SIZE', 256))
+except ValueError:
+    DATENO_CACHE_SIZE = 256
+# Maximum total size of search results in memory cache
+try:
+    DATENO_CACHE_MAX_BYTES = int(os.getenv('DATENO_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+except ValueError:
+    DATENO_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+search_cache = create_cache(DATENO_CACHE, path=DATENO_CACHE_PATH,
+                            max_size=DATENO_CACHE_SIZE, ttl=DATENO_CACHE_TTL,
+                            table='dateno_cache',
+                            max_bytes=DATENO_CACHE_MAX_BYTES)
+
+def search_cache_key(query, filters, offset=0, page=1, limit=500,
+  apikey=DATENO_API_KEY):
+    "Cache key of index search: API key, normalized query, sorted filters and paging"
+    query = ' '.join(str(query).lower().split())
+    filters = sorted(filters or [])
+    # Results depend on API key (access rights, invalid key errors)
+    return make_key('index_search', apikey, query, filters, offset, page, limit)
+
+# Concurrent identical searches share one Dateno API call
+search_flight = SingleFlight()
+
+def search_cache_stats():
+    "Search results cache hit rate and size"
+    if search_cache is None:
+      return None
+    return search_cache.stats()
+
+class DatenoSessionPool:
+    """
+    Pool of DatenoCmd sessions keyed by API key
+
+    A session is used by one search at a time and returned to the pool
+    afterwards, so its HTTP connections are reused by later searches.
+    """
+    def __init__(self, max_idle=DATENO_SESSION_POOL_SIZE, debug=DATENO_DEBUG):
+        self.max_idle = max_idle
+        self.debug = debug
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @contextmanager
+    def session(self, apikey=DATENO_API_KEY):
+        with self._lock:
+            idle = self._idle.setdefault(apikey, [])
+            cmd = idle.pop() if idle else None
+            if cmd is not None:
+                self.reused += 1
+            else:
+                self.created += 1
+        if cmd is None:
+            cmd = dateno.core.DatenoCmd(debug=self.debug, apikey=apikey)
+        try:
+            yield cmd
+        except Exception:
+            # Session may be in a broken state, don't reuse it
+            with self._lock:
+                self.discarded += 1
+            raise
+        else:
+            with self._lock:
+                idle = self._idle.setdefault(apikey, [])
+                if len(idle) < self.max_idle:
+                    idle.append(cmd)
+                else:
+                    self.discarded += 1
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'keys': len(self._idle),
+                'debug': self.debug,
+            }
+
+session_pool = DatenoSessionPool()
+
+def session_stats():
+    "Dateno sessions health: number of sessions created and reused"
+    return session_pool.stats()
 
 # Dateno search machinery
 def dateno_index_search(query, filters, apikey=DATENO_API_KEY,
-  offset=0, page=1, limit=500):
+  offset=0, page=1, limit=500, use_cache=True):
     "Call Dateno API for search in index"
     logging.debug(f'index_search {query=} {filters=}')
-    cmd=dateno.core.DatenoCmd(debug=True,
-                              apikey=apikey)
-
-    results=cmd.index_search(query=query,
-                             filters=filters,
-                             offset=offset,
-                             page=page,
-                             limit=limit
-                             )
-    return results
-
-def llm_index_search(llm_response, apikey=DATENO_API_KEY, offset=0, page=1, limit=500):
-    queries = []
-    for query in llm_response['queries']:
-      if query['filters']:
-        qfilters = [f'{f["name"]}={f["value"]}' for f in query['filters']]
-      else:
-        qfilters = []
-      logging.debug(f'{query=} {qfilters=}')
-      results = dateno_index_search(query['query'], qfilters, apikey=apikey, offset=offset, page=page, limit=limit)
-      queries.append({'query': query,
-                      'results': results})
+    key = search_cache_key(query, filters, offset, page, limit, apikey)
+    cache_key = None
+    if use_cache and search_cache is not None:
+      cache_key = key
+      results = search_cache.get(cache_key)
+      if results is not None:
+        logging.debug(f'index_search cache hit {cache_key=}')
+        return results
+
+    def search():
+      with session_pool.session(apikey) as cmd:
+        results=cmd.index_search(query=query,
+                                 filters=filters,
+                                 offset=offset,
+                                 page=page,
+                                 limit=limit
+                                 )
+      # Error responses (e.g. invalid API key) have no hits and aren't cached
+      if cache_key is not None and isinstance(results, dict) \
+          and 'hits' in results:
+        search_cache.set(cache_key, results)
+      return results
+
+    return search_flight.do(key, search)
+
+def search_flight_stats():
+    "Number of searches and searches that shared a concurrent identical call"
+    return search_flight.stats()
+
+def _page_hits(results):
+    "Extract hits list from Dateno index search results"
+    if isinstance(results, dict):
+      hits = results.get('hits', {})
+      if isinstance(hits, dict):
+        return hits.get('hits', [])
+      return hits
+    return []
+
+def iter_index_search(query, filters, apikey=DATENO_API_KEY, page_size=500,
+  max_hits=DATENO_SEARCH_MAX_HITS, prefetch=True):
+    """
+    Iterate over Dateno index search hits page by page
+
+    While hits of the current page are consumed, the next page is fetched
+    in the background, so at most two pages are held in memory.
+
+    Args:
+        query (str): Search query
+        filters (list): Search filters in 'name=value' format
+        apikey (str): Dateno API key
+        page_size (int): Number of hits requested per page
+        max_hits (int): Stop after this number of hits, None for no limit
+        prefetch (bool): Fetch the next page in the background
+
+    Yields:
+        dict: Search hit
+    """
+    def fetch(page):
+      # Pages bypass the search cache, a long scan must not fill it
+      return dateno_index_search(query, filters, apikey=apikey, offset=0,
+                                 page=page, limit=page_size, use_cache=False)
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+      page = 1
+      count = 0
+      if executor:
+        future = executor.submit(fetch, page)
+      while True:
+        results = future.result() if executor else fetch(page)
+        hits = _page_hits(results)
+        last_page = len(hits) < page_size or not hits
+        if max_hits is not None and count + len(hits) >= max_hits:
+          hits = hits[:max_hits - count]
+          last_page = True
+        if not last_page:
+          page += 1
+          if executor:
+            future = executor.submit(fetch, page)
+        del results
+        for hit in hits:
+          count += 1
+          yield hit
+        if last_page:
+          break
+    finally:
+      if executor:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def query_filters(query):
+    "Convert LLM query filters to Dateno 'name=value' filters"
+    if query.get('filters'):
+      return [f'{f["name"]}={f["value"]}' for f in query['filters']]
+    return []
+
+def llm_query_search(query, apikey=DATENO_API_KEY, offset=0, page=1, limit=500):
+    "Search single LLM query in Dateno index"
+    qfilters = query_filters(query)
+    logging.debug(f'{query=} {qfilters=}')
+    results = dateno_index_search(query['query'], qfilters, apikey=apikey, offset=offset, page=page, limit=limit)
+    return {'query': query,
+            'results': results}
+
+class _TimedSearch:
+    """
+    LLM query search submitted to executor
+
+    The query timeout is counted from the moment a worker starts it, time
+    spent queued behind other queries doesn't count. Waiting for the start
+    is limited by start_timeout (from submission), so a stuck worker can't
+    block the queued queries forever.
+    """
+    def __init__(self, executor, query, timeout, start_timeout, **kwargs):
+      self.query = query
+      self.timeout = timeout
+      self.submitted = time.monotonic()
+      self.start_timeout = start_timeout
+      self.start_time = None
+      self.started = threading.Event()
+      self.future = executor.submit(self._run, query, **kwargs)
+
+    def _run(self, query, **kwargs):
+      self.start_time = time.monotonic()
+      self.started.set()
+      return llm_query_search(query, **kwargs)
+
+    def done(self):
+      return self.future.done()
+
+    def result(self):
+      "Waits for search result, failed search gets None results and 'error'"
+      query = self.query
+      try:
+        remaining = None
+        if self.timeout is not None:
+          if self.start_timeout is not None:
+            wait = max(0, self.submitted + self.start_timeout - time.monotonic())
+            if not self.started.wait(wait):
+              self.future.cancel()
+              logging.error(f'index_search not started {query=}')
+              return {'query': query,
+                      'results': None,
+                      'error': f'Search did not start in {self.start_timeout} seconds'}
+          else:
+            self.started.wait()
+          remaining = max(0, self.start_time + self.timeout - time.monotonic())
+        return self.future.result(timeout=remaining)
+      except TimeoutError:
+        logging.error(f'index_search timeout {query=}')
+        return {'query': query,
+                'results': None,
+                'error': f'Search timed out after {self.timeout} seconds'}
+      except Exception as e:
+        logging.error(f'index_search error {query=}: {e}')
+        return {'query': query,
+                'results': None,
+                'error': str(e)}
+
+def _start_timeout(timeout, queued, max_workers):
+    "Longest wait for the start of query with `queued` queries ahead of it"
+    if timeout is None:
+      return None
+    # Every round of max_workers queries ahead ends in at most timeout
+    return timeout * (queued // max_workers + 1)
+
+def llm_index_search(llm_response, apikey=DATENO_API_KEY, offset=0, page=1, limit=500,
+  max_workers=DATENO_SEARCH_WORKERS, timeout=DATENO_SEARCH_TIMEOUT):
+    """
+    Search all LLM queries in Dateno index in parallel
+
+    Results are returned in the order of queries. A failed or timed out
+    query gets None results and an 'error' message, other queries are
+    not affected. The timeout of every query starts when it starts running.
+    """
+    llm_queries = llm_response['queries']
+    if not llm_queries:
+      return []
+
+    workers = max(1, min(max_workers, len(llm_queries)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    searches = [_TimedSearch(executor, query, timeout,
+                             _start_timeout(timeout, n, workers),
+                             apikey=apikey, offset=offset, page=page,
+                             limit=limit)
+                for n, query in enumerate(llm_queries)]
+    queries = [search.result() for search in searches]
+    # Don't wait for timed out searches
+    executor.shutdown(wait=False, cancel_futures=True)
 
     return queries
 
+def llm_stream_index_search(queries, apikey=DATENO_API_KEY, offset=0, page=1, limit=500,
+  max_workers=DATENO_SEARCH_WORKERS, timeout=DATENO_SEARCH_TIMEOUT):
+    """
+    Search every query from the stream of LLM queries as soon as it arrives
 
+    Searches run in parallel like in llm_index_search() while the stream
+    is still being received, results are yielded in the order of queries.
+    The timeout of every query starts when it starts running.
+    """
+    workers = max(1, max_workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+      for query in queries:
+        queued = sum(1 for search in pending if not search.done())
+        pending.append(_TimedSearch(executor, query, timeout,
+                                    _start_timeout(timeout, queued, workers),
+                                    apikey=apikey, offset=offset, page=page,
+                                    limit=limit))
+        # Yield finished searches without waiting for the rest of stream
+        while pending and pending[0].done():
+          yield pending.popleft().result()
+      while pending:
+        yield pending.popleft().result()
+    finally:
+      # Don't wait for timed out or abandoned searches
+      executor.shutdown(wait=False, cancel_futures=True)
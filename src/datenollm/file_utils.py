@@ -1,13 +1,46 @@
+import errno
 import json
 import logging
 import os
+import stat
 import sys
+import tempfile
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    # Optional faster JSON backend
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
 # Path constants
 DRIVE_PATH = os.environ.get('DRIVE_PATH', '/content/drive/MyDrive/colab_data/dateno/')
 LOCAL_BASE_PATH = '.'
 
+def _read_umask():
+    # umask can only be read by setting it, done once at import, as changing
+    # it later would race with files created by other threads
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+# Permissions of new files saved by save_json_file()
+UMASK = _read_umask()
+
+# Seconds to wait for a file lock
+LOCK_TIMEOUT = float(os.environ.get('DATENOLLM_LOCK_TIMEOUT', 30))
+# Optimistic attempts of update_json_file() before updating under the lock
+UPDATE_RETRIES = 3
+
 log_level = getattr(logging, os.environ.get('DATENOLLM_DEBUG', 'ERROR').upper(), logging.INFO)
 logging.basicConfig(
     level=log_level,
@@ -15,17 +48,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def is_colab_environment():
-    """Checks if the code is running in Google Colab"""
-    try:
-        import google.colab
-        return True
-    except ImportError:
-        return False
+class EnvironmentContext:
+    """
+    Per-process environment state
 
-def mount_drive_if_needed():
-    """Mounts Drive if necessary and we are in Colab"""
-    if is_colab_environment():
+    Environment detection (Colab or local) runs once, Drive is mounted once,
+    resolved full paths are cached. Local relative paths depend on the
+    current directory, so the cache is dropped when it changes.
+    """
+    def __init__(self):
+        self._colab = None
+        self._drive_mounted = False
+        self._paths = {}
+        self._cwd = None
+
+    @property
+    def colab(self):
+        if self._colab is None:
+            try:
+                import google.colab
+                self._colab = True
+            except ImportError:
+                self._colab = False
+        return self._colab
+
+    @property
+    def name(self):
+        return 'colab' if self.colab else 'local'
+
+    def mount_drive(self):
+        if self._drive_mounted or not self.colab:
+            return True
         try:
             from google.colab import drive
             if not os.path.exists('/content/drive'):
@@ -37,7 +90,65 @@ def mount_drive_if_needed():
         except Exception as e:
             logger.error(f"Error connecting Google Drive: {e}")
             return False
-    return True
+        self._drive_mounted = True
+        return True
+
+    def full_path(self, file_path, base_path=None):
+        file_path = os.fspath(file_path)
+        # If the path is already absolute, return as is
+        if os.path.isabs(file_path):
+            return file_path
+
+        if self.colab:
+            # In Colab we work with Google Drive
+            self.mount_drive()
+        else:
+            cwd = os.getcwd()
+            if cwd != self._cwd:
+                self._paths.clear()
+                self._cwd = cwd
+
+        key = (file_path, base_path)
+        full_path = self._paths.get(key)
+        if full_path is not None:
+            return full_path
+
+        if self.colab:
+            if not base_path:
+                base_path = DRIVE_PATH
+            # If the path doesn't start with base_path, add prefix
+            if not file_path.startswith(base_path):
+                full_path = os.path.join(base_path, file_path)
+            else:
+                full_path = file_path
+        else:
+            if not base_path:
+                base_path = LOCAL_BASE_PATH
+            # In local environment we work with local file system
+            full_path = os.path.join(base_path, file_path)
+            # Convert to absolute path
+            full_path = os.path.abspath(full_path)
+
+        self._paths[key] = full_path
+        return full_path
+
+    def clear(self):
+        """Forgets detected environment and resolved paths"""
+        self._colab = None
+        self._drive_mounted = False
+        self._paths.clear()
+        self._cwd = None
+
+
+environment = EnvironmentContext()
+
+def is_colab_environment():
+    """Checks if the code is running in Google Colab"""
+    return environment.colab
+
+def mount_drive_if_needed():
+    """Mounts Drive if necessary and we are in Colab"""
+    return environment.mount_drive()
 
 def get_full_path(file_path, base_path=None):
     """
@@ -50,29 +161,7 @@ def get_full_path(file_path, base_path=None):
     Returns:
         str: Full path to the file
     """
-    # If the path is already absolute, return as is
-    if os.path.isabs(file_path):
-        return file_path
-    
-    if is_colab_environment():
-        # In Colab we work with Google Drive
-        mount_drive_if_needed()
-        if not base_path:
-            base_path = DRIVE_PATH
-        # If the path doesn't start with base_path, add prefix
-        if not file_path.startswith(base_path):
-            full_path = os.path.join(base_path, file_path)
-        else:
-            full_path = file_path
-    else:
-        if not base_path:
-            base_path = LOCAL_BASE_PATH
-        # In local environment we work with local file system
-        full_path = os.path.join(base_path, file_path)
-        # Convert to absolute path
-        full_path = os.path.abspath(full_path)
-    
-    return full_path
+    return environment.full_path(file_path, base_path)
 
 def file_exists(file_path):
     """
@@ -88,10 +177,11 @@ def file_exists(file_path):
         full_path = get_full_path(file_path)
         exists = os.path.exists(full_path)
         
-        if is_colab_environment():
-            logger.debug(f"Checking file in Google Drive: {full_path}")
-        else:
-            logger.debug(f"Checking file locally: {full_path}")
+        if logger.isEnabledFor(logging.DEBUG):
+            if environment.colab:
+                logger.debug(f"Checking file in Google Drive: {full_path}")
+            else:
+                logger.debug(f"Checking file locally: {full_path}")
 
         return exists
     except Exception as e:
@@ -154,29 +244,48 @@ def get_file_info(file_path):
     try:
         full_path = get_full_path(file_path)
         
-        if not file_exists(full_path):
+        try:
+            # The only stat call, file type is taken from its result
+            stat_info = os.stat(full_path)
+        except FileNotFoundError:
             return None
         
-        stat_info = os.stat(full_path)
-        
         return {
             'path': full_path,
             'size': stat_info.st_size,
             'modified': stat_info.st_mtime,
-            'is_file': os.path.isfile(full_path),
-            'is_directory': os.path.isdir(full_path),
-            'environment': 'colab' if is_colab_environment() else 'local'
+            'is_file': stat.S_ISREG(stat_info.st_mode),
+            'is_directory': stat.S_ISDIR(stat_info.st_mode),
+            'environment': environment.name
         }
     except Exception as e:
         logger.error(f"Error getting file information: {e}")
         return None
 
+def loads_json(data, encoding='utf-8'):
+    """Parses JSON from bytes (or memoryview with orjson backend)"""
+    if orjson is not None and encoding.lower().replace('_', '-') in ('utf-8', 'utf8'):
+        return orjson.loads(data)
+    return json.loads(bytes(data).decode(encoding))
+
+def _dumps_json(data, compact=False):
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    if compact:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    else:
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+    return text.encode('utf-8')
+
 def read_json_file(file_path, encoding='utf-8'):
     if not file_exists(file_path):
         return []
     try:
-        with open(file_path, 'r', encoding=encoding) as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return loads_json(f.read(), encoding)
     except FileNotFoundError:
         return []
     except Exception as e:
@@ -193,15 +302,173 @@ def read_text_file(file_path, encoding='utf-8'):
         logger.error(f"Error reading text file {file_path}: {e}")
         sys.exit(1)
 
-def save_json_file(data, file_path, encoding='utf-8'):
-    if not file_exists(os.path.dirname(file_path)):
-        create_directory_if_not_exists(os.path.dirname(file_path))
+def save_json_file(data, file_path, encoding='utf-8', compact=False, fsync=False):
+    """
+    Saves data as JSON file atomically
+
+    Data is written to a temporary file in the same directory which then
+    replaces the target, so readers never see a partially written file.
+
+    Args:
+        data: JSON serializable data
+        file_path (str): Path to the file
+        encoding (str): File encoding
+        compact (bool): Write without indentation and spaces
+        fsync (bool): Flush file (and directory entry) to disk before returning
+    """
+    directory = os.path.dirname(file_path)
+    if not file_exists(directory):
+        create_directory_if_not_exists(directory)
+    tmp_path = None
     try:
-        with open(file_path, 'w', encoding=encoding) as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        content = _dumps_json(data, compact)
+        if encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            content = content.decode('utf-8').encode(encoding)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(file_path)}.',
+                                        suffix='.tmp', dir=directory or '.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            # Keep permissions of the replaced file
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, file_path)
+        tmp_path = None
+        if fsync:
+            _fsync_directory(directory or '.')
     except Exception as e:
         logger.error(f"Error saving JSON file {file_path}: {e}")
         sys.exit(1)
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+def _fsync_directory(directory):
+    # Persist rename, not supported on some platforms
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def file_stamp(file_path):
+    """
+    Returns version stamp of the file or None if it doesn't exist
+
+    Files saved by save_json_file() are replaced by rename, so the stamp
+    (inode, modification time, size) changes on every save.
+    """
+    try:
+        stat_info = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat_info.st_ino, stat_info.st_mtime_ns, stat_info.st_size)
+
+def _try_lock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def file_lock(file_path, timeout=None, poll_interval=0.05):
+    """
+    Advisory exclusive lock of the file, held on the sidecar <file_path>.lock
+
+    Usage:
+        with file_lock('history.json'):
+            ...
+
+    Raises:
+        TimeoutError: If the lock is not acquired in timeout seconds
+    """
+    if timeout is None:
+        timeout = LOCK_TIMEOUT
+    lock_path = f'{file_path}.lock'
+    directory = os.path.dirname(lock_path)
+    if directory and not os.path.exists(directory):
+        create_directory_if_not_exists(directory)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+    locked = False
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _try_lock(fd)
+                locked = True
+                break
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES, errno.EDEADLK):
+                    # File system without locks (e.g. some network mounts)
+                    logger.warning(f"File locking is not supported for {file_path}: {e}")
+                    break
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timeout waiting for lock of {file_path}")
+                time.sleep(poll_interval)
+        yield
+    finally:
+        if locked:
+            _unlock(fd)
+        os.close(fd)
+
+def update_json_file(file_path, update, data=None, stamp=None,
+                     retries=UPDATE_RETRIES, **kwargs):
+    """
+    Read-modify-write of JSON file safe for concurrent writers
+
+    The new content is computed without the lock from data read at the
+    version `stamp` (see file_stamp()); the lock is taken only to check
+    that the file was not changed meanwhile and to save. If it was changed,
+    the update is retried on the fresh content, the last attempt is made
+    entirely under the lock.
+
+    Args:
+        file_path (str): Path to the file
+        update (callable): Returns new data for the current data, must not
+            modify its argument
+        data: Already read content of the file
+        stamp: file_stamp() taken before data was read
+        retries (int): Number of optimistic attempts
+        **kwargs: save_json_file() arguments
+
+    Returns:
+        New data
+    """
+    for attempt in range(retries):
+        if data is None or stamp is None:
+            stamp = file_stamp(file_path)
+            data = read_json_file(file_path)
+        new_data = update(data)
+        with file_lock(file_path):
+            if file_stamp(file_path) == stamp:
+                save_json_file(new_data, file_path, **kwargs)
+                return new_data
+        logger.debug(f'{file_path} changed concurrently, retrying update')
+        data = None
+
+    with file_lock(file_path):
+        new_data = update(read_json_file(file_path))
+        save_json_file(new_data, file_path, **kwargs)
+    return new_data
 
 
 # Usage example
@@ -0,0 +1,198 @@
+# Data preparation for LLM filtering of Dateno search results
+#
+# Optional environment variables:
+# DATENOLLM_FILTER_FIELDS - Comma separated fields kept for each hit, e.g.
+#   '_id,title,description,source.countries.name' (default: whole hits are kept,
+#   filter prompts check geography, time coverage and language of datasets)
+# DATENOLLM_FILTER_TOKEN_BUDGET - Maximum estimated tokens of data per LLM call (default: 8000)
+# DATENOLLM_CHARS_PER_TOKEN - Characters per token used for estimation (default: 4)
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    default_filter_fields = [f.strip() for f in
+                             os.environ['DATENOLLM_FILTER_FIELDS'].split(',')
+                             if f.strip()]
+except KeyError:
+    default_filter_fields = None
+try:
+    default_token_budget = int(os.environ['DATENOLLM_FILTER_TOKEN_BUDGET'])
+except:
+    default_token_budget = 8000
+try:
+    default_chars_per_token = float(os.environ['DATENOLLM_CHARS_PER_TOKEN'])
+except:
+    default_chars_per_token = 4
+
+
+def dumps_compact(data):
+    """Serialize data to JSON without indentation and extra whitespace"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+def estimate_tokens(text, chars_per_token=None):
+    """Rough token count estimation for text"""
+    if not chars_per_token:
+        chars_per_token = default_chars_per_token
+    return int(len(text) / chars_per_token) + 1
+
+def _get_field(hit, field):
+    # Top level fields ('_id', '_score', ...)
+    if field in hit:
+        return hit[field]
+    source = hit.get('_source', {})
+    # Dataset fields ('title', 'description', ...)
+    dataset = source.get('dataset', {})
+    if isinstance(dataset, dict) and field in dataset:
+        return dataset[field]
+    # Dotted path inside '_source' ('source.name', 'dataset.formats', ...),
+    # lists are mapped ('source.countries.name' gives list of names)
+    value = source
+    for key in field.split('.'):
+        if isinstance(value, list):
+            value = [item[key] for item in value
+                     if isinstance(item, dict) and key in item]
+        elif isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            return None
+    return value
+
+def project_hit(hit, fields=None):
+    """
+    Strips Dateno search hit to the given fields
+
+    Args:
+        hit (dict): Dateno index search hit
+        fields (list): Field names, looked up at the top level of the hit,
+            in '_source.dataset' and as dotted paths in '_source'.
+            Without fields (and DATENOLLM_FILTER_FIELDS) hit is kept whole.
+
+    Returns:
+        dict: Projected hit, fields without values are omitted
+    """
+    if not isinstance(hit, dict):
+        return hit
+    if not fields:
+        fields = default_filter_fields
+    if not fields:
+        return hit
+    projected = {}
+    for field in fields:
+        value = _get_field(hit, field)
+        if value not in (None, '', [], {}):
+            projected[field] = value
+    return projected
+
+def _hits(results):
+    # Dateno index search returns {'hits': {'hits': [...]}}
+    if isinstance(results, dict) and 'hits' in results:
+        hits = results['hits']
+        if isinstance(hits, dict):
+            hits = hits.get('hits', [])
+        return hits
+    if isinstance(results, list):
+        return results
+    return []
+
+def _groups(data):
+    # Filter data is a list of {'queries': [...], 'results': [...]} groups,
+    # a single group or a plain list of hits
+    if isinstance(data, dict):
+        data = [data]
+    if data and all(isinstance(item, dict) and 'results' in item for item in data):
+        return [(item.get('queries'), _hits(item['results'])) for item in data], True
+    return [(None, _hits(data))], False
+
+def hit_ids(data):
+    """Returns '_id' values of all hits in filter data (or chunk)"""
+    groups, grouped = _groups(data)
+    return [hit.get('_id') for queries, hits in groups for hit in hits
+            if isinstance(hit, dict)]
+
+def project_data(data, fields=None):
+    """Strips all hits in filter data to the given fields"""
+    groups, grouped = _groups(data)
+    if not grouped:
+        return [project_hit(hit, fields) for hit in groups[0][1]]
+    return [{'queries': queries,
+             'results': [project_hit(hit, fields) for hit in hits]}
+            for queries, hits in groups]
+
+def chunk_data(data, token_budget=None, fields=None, chars_per_token=None,
+               max_hits=None):
+    """
+    Projects filter data and cuts it into chunks fitting the token budget
+
+    Every chunk keeps the structure of the data (groups keep their
+    'queries'), so each of them can be sent in a separate LLM call.
+    A single hit larger than the budget gets a chunk of its own.
+
+    Args:
+        data (list): Filter data
+        token_budget (int): Maximum estimated tokens of serialized chunk
+        fields (list): Fields kept for each hit
+        chars_per_token (float): Characters per token used for estimation
+        max_hits (int): Maximum number of hits per chunk
+
+    Returns:
+        list: Chunks of projected data
+    """
+    if not token_budget:
+        token_budget = default_token_budget
+    groups, grouped = _groups(project_data(data, fields))
+
+    chunks = []
+    for queries, hits in groups:
+        if grouped:
+            overhead = estimate_tokens(
+                dumps_compact([{'queries': queries, 'results': []}]),
+                chars_per_token)
+        else:
+            overhead = 1
+        current = []
+        current_tokens = overhead
+        for hit in hits:
+            hit_tokens = estimate_tokens(dumps_compact(hit), chars_per_token)
+            if current and (current_tokens + hit_tokens > token_budget
+                            or (max_hits and len(current) >= max_hits)):
+                chunks.append((queries, current))
+                current = []
+                current_tokens = overhead
+            current.append(hit)
+            current_tokens += hit_tokens
+        if current or not hits:
+            chunks.append((queries, current))
+
+    if grouped:
+        chunks = [[{'queries': queries, 'results': hits}]
+                  for queries, hits in chunks]
+    else:
+        chunks = [hits for queries, hits in chunks]
+    logger.debug(f'chunk_data(): {len(chunks)} chunks for {token_budget=}')
+    return chunks
+
+def merge_results(results):
+    """
+    Merges parsed JSON results of per-chunk LLM calls
+
+    Lists are concatenated, dicts are merged recursively and for other
+    values the first one wins.
+    """
+    merged = None
+    for result in results:
+        if merged is None:
+            merged = result
+        elif isinstance(merged, dict) and isinstance(result, dict):
+            merged = dict(merged)
+            for key, value in result.items():
+                if key in merged:
+                    merged[key] = merge_results([merged[key], value])
+                else:
+                    merged[key] = value
+        elif isinstance(merged, list) and isinstance(result, list):
+            merged = merged + result
+    return merged
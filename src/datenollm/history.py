@@ -0,0 +1,434 @@
+# Dialog history storage
+#
+# History is a list of messages ({'role': ..., 'metadata': ..., 'content': ...,
+# 'options': ...}). Files with '.jsonl' extension are kept as an append-only
+# log of records {"i": <message index>, "message": {...}}. Update records
+# ({"i": ..., "message": ..., "update": true}) replace the message with the
+# same index (e.g. like/dislike metadata update).
+# Other files are kept as JSON list of messages, as before.
+#
+# Writes of both formats hold an advisory lock (<history file>.lock), so
+# several notebook kernels and CLI processes may share a history file.
+#
+# Optional environment variables (history sent to LLM):
+# DATENOLLM_HISTORY_MAX_TURNS - Maximum number of last turns (default: unlimited)
+# DATENOLLM_HISTORY_MAX_TOKENS - Maximum estimated tokens of history (default: unlimited)
+# DATENOLLM_HISTORY_LIKED_ONLY - Send only liked turns (default: false)
+
+import json
+import logging
+import mmap
+import os
+import threading
+
+from .file_utils import (
+    create_directory_if_not_exists,
+    file_lock,
+    file_stamp,
+    loads_json,
+    read_json_file,
+    save_json_file,
+    update_json_file,
+)
+from .filter_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Compact JSONL history when it has more replaced records than this
+COMPACT_THRESHOLD = 100
+
+# JSON history file -> (file stamp, number of messages) of the last load,
+# lets writers reuse the loaded history if the file wasn't changed since
+_loaded = {}
+
+
+def _env_int(name):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class HistoryPolicy:
+    """
+    Selection of history turns sent to LLM
+
+    Args:
+        max_turns (int): Keep only the last N turns
+        max_tokens (int): Keep the last turns fitting the estimated token budget
+        liked_only (bool): Keep only turns liked by user (assistant message
+            metadata 'like_dislike' is 'Like'), like in history2context()
+    """
+    def __init__(self, max_turns=None, max_tokens=None, liked_only=False):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.liked_only = liked_only
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_turns=_env_int('DATENOLLM_HISTORY_MAX_TURNS'),
+            max_tokens=_env_int('DATENOLLM_HISTORY_MAX_TOKENS'),
+            liked_only=os.environ.get('DATENOLLM_HISTORY_LIKED_ONLY', '').lower()
+                in ('1', 'true', 'yes'),
+        )
+
+    def update(self, max_turns=None, max_tokens=None, liked_only=None):
+        """Returns policy with the given settings overridden"""
+        return HistoryPolicy(
+            max_turns=max_turns if max_turns is not None else self.max_turns,
+            max_tokens=max_tokens if max_tokens is not None else self.max_tokens,
+            liked_only=liked_only if liked_only is not None else self.liked_only,
+        )
+
+    def narrow(self, max_turns=None, max_tokens=None, liked_only=None):
+        """Returns policy tightened by the given settings, never relaxed"""
+        def limit(current, requested):
+            if requested is None:
+                return current
+            if current is None:
+                return requested
+            return min(current, requested)
+
+        return HistoryPolicy(
+            max_turns=limit(self.max_turns, max_turns),
+            max_tokens=limit(self.max_tokens, max_tokens),
+            liked_only=self.liked_only or bool(liked_only),
+        )
+
+    @property
+    def unlimited(self):
+        return self.max_turns is None and self.max_tokens is None \
+            and not self.liked_only
+
+    def apply(self, history):
+        """Returns history messages selected by the policy"""
+        if self.unlimited or not history:
+            return history
+
+        # Group messages into turns, each turn ends with assistant message
+        turns = []
+        turn = []
+        for msg in history:
+            turn.append(msg)
+            if msg.get('role') == 'assistant':
+                turns.append(turn)
+                turn = []
+        if turn:
+            turns.append(turn)
+
+        if self.liked_only:
+            turns = [turn for turn in turns
+                     if (turn[-1].get('metadata') or {}).get('like_dislike') == 'Like']
+        if self.max_turns is not None:
+            turns = turns[-self.max_turns:] if self.max_turns > 0 else []
+        if self.max_tokens is not None:
+            selected = []
+            tokens = 0
+            for turn in reversed(turns):
+                tokens += sum(estimate_tokens(str(msg.get('content', '')))
+                              for msg in turn)
+                if tokens > self.max_tokens:
+                    break
+                selected.append(turn)
+            turns = list(reversed(selected))
+
+        return [msg for turn in turns for msg in turn]
+
+
+def is_jsonl(file_path):
+    """Checks if history file is kept in append-only JSONL format"""
+    return str(file_path).endswith('.jsonl')
+
+
+class HistoryStore:
+    """Append-only JSONL history file"""
+    def __init__(self, file_path, compact_threshold=COMPACT_THRESHOLD):
+        self.file_path = file_path
+        self.compact_threshold = compact_threshold
+
+    def _records(self):
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    # Tail of interrupted write
+                    logger.warning(f"Skipping broken record in {self.file_path}: {e}")
+
+    def _tail_records(self, block_size=65536):
+        # Yields records from the end of file
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            rest = b''
+            while position > 0:
+                size = min(block_size, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + rest).split(b'\n')
+                rest = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            pass
+            if rest.strip():
+                try:
+                    yield json.loads(rest)
+                except json.JSONDecodeError:
+                    pass
+
+    def __len__(self):
+        """Number of messages in history"""
+        for record in self._tail_records():
+            if not record.get('update'):
+                return record['i'] + 1
+        return 0
+
+    def read(self, last_turns=None):
+        """
+        Reads history messages
+
+        Args:
+            last_turns (int): Read only the last N turns (user/assistant
+                message pairs) from the end of file
+
+        Returns:
+            list: History messages
+        """
+        if last_turns is not None:
+            return self._read_tail(last_turns * 2)
+
+        messages = {}
+        replaced = 0
+        for record in self._records():
+            if record['i'] in messages:
+                replaced += 1
+            messages[record['i']] = record['message']
+        if replaced > self.compact_threshold:
+            self.compact()
+        return [messages[i] for i in sorted(messages)]
+
+    def _read_tail(self, count):
+        if count <= 0:
+            return []
+        messages = {}
+        updates = {}
+        start = None
+        for record in self._tail_records():
+            index = record['i']
+            if record.get('update'):
+                # The newest update of the message wins
+                updates.setdefault(index, record['message'])
+                continue
+            if start is None:
+                # The last appended message defines the window
+                start = max(0, index - count + 1)
+            if index < start:
+                break
+            messages[index] = updates.get(index, record['message'])
+        return [messages[i] for i in sorted(messages)]
+
+    def append(self, messages):
+        """Appends messages to the end of history"""
+        directory = os.path.dirname(self.file_path)
+        if directory and not os.path.exists(directory):
+            create_directory_if_not_exists(directory)
+        # Message indexes of concurrent writers must not overlap
+        with file_lock(self.file_path):
+            start = len(self)
+            lines = [json.dumps({'i': start + n, 'message': message},
+                                ensure_ascii=False) + '\n'
+                     for n, message in enumerate(messages)]
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+
+    def update(self, index, message):
+        """Replaces message with the given index"""
+        line = json.dumps({'i': index, 'message': message, 'update': True},
+                          ensure_ascii=False) + '\n'
+        with file_lock(self.file_path):
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def _write(self, messages):
+        tmp_path = f'{self.file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for i in sorted(messages):
+                f.write(json.dumps({'i': i, 'message': messages[i]},
+                                   ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.file_path)
+
+    def compact(self):
+        """Rewrites history file keeping only the latest record of every message"""
+        # Records appended by other writers while rewriting would be lost
+        with file_lock(self.file_path):
+            messages = {}
+            for record in self._records():
+                messages[record['i']] = record['message']
+            self._write(messages)
+        logger.debug(f'History {self.file_path} compacted')
+
+    def import_json(self, json_path):
+        """Replaces history with messages from JSON list file"""
+        self.replace(read_json_file(json_path))
+
+    def replace(self, messages):
+        """Replaces history with the given messages"""
+        with file_lock(self.file_path):
+            self._write(dict(enumerate(messages)))
+
+    def export_json(self, json_path):
+        """Saves history as JSON list file"""
+        save_json_file(self.read(), json_path)
+
+
+def _map_file(f):
+    # Empty files can't be mapped
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _parse_context(file_path):
+    with open(file_path, 'rb') as f:
+        data = _map_file(f)
+        if data is None:
+            return ()
+        with data:
+            if not is_jsonl(file_path):
+                # The view must be released before the mapping is closed,
+                # also when parse error traceback keeps a reference to it
+                with memoryview(data) as view:
+                    messages = loads_json(view)
+                if not isinstance(messages, list):
+                    raise ValueError(f"{file_path} does not contain a valid JSON list.")
+                return tuple(messages)
+
+            # JSONL history records or plain messages, one per line
+            messages = {}
+            for line in iter(data.readline, b''):
+                if not line.strip():
+                    continue
+                record = loads_json(line)
+                if 'message' in record and 'i' in record:
+                    messages[record['i']] = record['message']
+                else:
+                    messages[len(messages)] = record
+            return tuple(messages[i] for i in sorted(messages))
+
+
+class ContextStore:
+    """
+    Cache of parsed context files
+
+    Context (curated dialog examples sent before the history) is parsed
+    once and reused while the file stamp (see file_stamp()) is unchanged.
+    The file is memory-mapped for parsing, JSONL contexts are decoded line
+    by line. Contexts are returned as tuples shared by all callers.
+    """
+    def __init__(self):
+        self._contexts = {}
+        self._lock = threading.Lock()
+
+    def load(self, file_path):
+        """
+        Returns context messages of JSON list or JSONL file
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+            ValueError: If the file is not a list of messages
+        """
+        stamp = file_stamp(file_path)
+        if stamp is None:
+            raise FileNotFoundError(file_path)
+        with self._lock:
+            cached = self._contexts.get(file_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        messages = _parse_context(file_path)
+        with self._lock:
+            self._contexts[file_path] = (stamp, messages)
+        logger.debug(f'Context {file_path} loaded: {len(messages)} messages')
+        return messages
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+
+
+context_store = ContextStore()
+
+def load_context(file_path):
+    """Returns cached context messages of JSON list or JSONL file"""
+    return context_store.load(file_path)
+
+def save_context(messages, file_path):
+    """Saves context messages as JSON list or JSONL file"""
+    if is_jsonl(file_path):
+        HistoryStore(file_path).replace(messages)
+    else:
+        save_json_file(list(messages), file_path)
+
+
+def load_history(file_path, last_turns=None):
+    """Reads history messages from JSON or JSONL history file"""
+    if is_jsonl(file_path):
+        return HistoryStore(file_path).read(last_turns)
+    stamp = file_stamp(file_path)
+    history = read_json_file(file_path)
+    _loaded[file_path] = (stamp, len(history))
+    if last_turns is not None:
+        history = history[-last_turns * 2:] if last_turns > 0 else []
+    return history
+
+def _loaded_stamp(file_path, history):
+    # Stamp of the file version `history` was loaded from, if known
+    if history is None:
+        return None
+    stamp, length = _loaded.get(file_path, (None, None))
+    return stamp if length == len(history) else None
+
+def _update_json_history(file_path, update, history):
+    history = update_json_file(file_path, update, data=history,
+                               stamp=_loaded_stamp(file_path, history))
+    _loaded[file_path] = (file_stamp(file_path), len(history))
+
+def append_history(file_path, messages, history=None):
+    """
+    Appends messages to JSON or JSONL history file
+
+    For JSON files the whole list is rewritten, `history` (the current
+    file content, if already loaded) saves re-reading it unless the file
+    was changed by another writer since it was loaded.
+    """
+    if is_jsonl(file_path):
+        HistoryStore(file_path).append(messages)
+        return
+    messages = list(messages)
+    _update_json_history(file_path, lambda history: list(history) + messages,
+                         history)
+
+def update_history_message(file_path, index, message, history=None):
+    """Replaces message with the given index in JSON or JSONL history file"""
+    if is_jsonl(file_path):
+        HistoryStore(file_path).update(index, message)
+        return
+
+    def update(history):
+        history = list(history)
+        if index < len(history):
+            history[index] = message
+        else:
+            logger.warning(f"No message {index} in history {file_path}")
+        return history
+
+    _update_json_history(file_path, update, history)
@@ -0,0 +1,106 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StreamItemsParser:
+    """
+    Incremental parser of streamed LLM JSON output
+
+    Text is fed as it arrives, markdown code fences around the JSON object
+    are skipped. Every item of the top level array under `key` (e.g.
+    `queries`) is returned as soon as its closing bracket is received.
+
+    Usage:
+        parser = StreamItemsParser('queries')
+        for chunk in stream:
+            for item in parser.feed(chunk):
+                ...
+    """
+    def __init__(self, key='queries'):
+        self.key = key
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.array_depth = None
+        self.item_start = None
+
+    def feed(self, text):
+        """Adds text to the parser, returns list of items completed by it"""
+        self.buffer += text
+        items = []
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            char = buffer[i]
+            if self.finished:
+                break
+            if not self.started:
+                # Skip markdown fences and other text before JSON object
+                if char == '{':
+                    self.started = True
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = buffer[self.string_start + 1:i]
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char in '{[':
+                if (char == '[' and self.depth == 1
+                        and self.last_string == self.key):
+                    self.array_depth = self.depth + 1
+                elif self.array_depth and self.depth == self.array_depth:
+                    self.item_start = i
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.array_depth and self.depth == self.array_depth \
+                        and self.item_start is not None:
+                    item = buffer[self.item_start:i + 1]
+                    self.item_start = None
+                    try:
+                        items.append(json.loads(item))
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Invalid streamed item: {e}")
+                elif self.array_depth and self.depth < self.array_depth:
+                    self.array_depth = None
+                if self.depth == 0:
+                    self.finished = True
+        self.pos = len(buffer)
+        return items
+
+
+def iter_stream_items(responses, key='queries'):
+    """
+    Yields items of `key` array from the stream of accumulated responses
+
+    Works with Server.llm_query_stream() and DatenoClient.ask_stream()
+    output, where every value is the response generated so far.
+    """
+    parser = StreamItemsParser(key)
+    received = ''
+    for response in responses:
+        if not response.startswith(received):
+            # Final cleaned response, everything was parsed already
+            continue
+        delta = response[len(received):]
+        received = response
+        for item in parser.feed(delta):
+            yield item
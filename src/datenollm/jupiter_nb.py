@@ -12,8 +12,12 @@ from .file_utils import (
     mount_drive_if_needed,
     get_full_path,
     file_exists,
-    read_json_file,
-    save_json_file
+)
+from .history import (
+    load_context,
+    load_history,
+    save_context,
+    update_history_message,
 )
 
 
@@ -22,17 +26,18 @@ def ask_llm(client, query, context_file=None, history_file=None, params=None):
     return None, None, None, "Ask something"
 
   history = []
+  context = []
   
   if context_file:
     context_file = get_full_path(context_file, DRIVE_PATH)
     print(f'{context_file=}')
     if file_exists(context_file):
         try:
-            context_data = read_json_file(context_file)
-            if isinstance(context_data, list):
-                history.extend(context_data)
-            else:
-                return None, None, None, f"Warning: context_file {context_file} does not contain a valid JSON list."
+            # Parsed once per file version and shared between turns
+            context = load_context(context_file)
+            history.extend(context)
+        except ValueError as e:
+            return None, None, None, f"Warning: {e}"
         except Exception as e:
             return None, None, None, f"Error reading context_file {context_file}: {e}"
     else:
@@ -46,26 +51,20 @@ def ask_llm(client, query, context_file=None, history_file=None, params=None):
   print(f'{history_file=}')
 
   if file_exists(history_file):
-    history.extend(read_json_file(history_file))
-
-  if not params:
-    params = {}
-
-  params['history'] = history
-  params = json.dumps(params)
+    history.extend(load_history(history_file))
 
-  result = client.ask(query=query, history_path=history_file)
+  # Client sends context with the history and appends the new turn to history_file
+  result = client.ask(query=query, history_path=history_file, context=context)
 
   history.append({'role': 'user', 'metadata': None, 'content': query, 'options': None})
   history.append({'role': 'assistant', 'metadata': None, 'content': result, 'options': None})
-  save_json_file(history, history_file)
 
   return query, result, history, None
 
 def history2context(history_file, context_file):
   history_file = get_full_path(history_file, DRIVE_PATH)
   context_file = get_full_path(context_file, DRIVE_PATH)
-  history = read_json_file(history_file)
+  history = load_history(history_file)
   context = []
   for item in history:
     if item['role'] == 'user':
@@ -75,7 +74,7 @@ def history2context(history_file, context_file):
       if assistant.get('metadata') and assistant['metadata'].get("like_dislike"):
         context.append(user)
         context.append(assistant)
-  save_json_file(context, context_file)
+  save_context(context, context_file)
 
 class ChatWidget:
     def __init__(self, history_file=None):
@@ -90,12 +89,14 @@ class ChatWidget:
 
     def load_history(self):
         if file_exists(self.history_file):
-          self.history = read_json_file(self.history_file)
+          self.history = load_history(self.history_file)
         else:
           self.history = []
 
     def save_history(self):
-        save_json_file(self.history, self.history_file)
+        # Only the last message is changed by like/dislike
+        update_history_message(self.history_file, len(self.history) - 1,
+                               self.history[-1], self.history)
 
     def create_widgets(self):
         self.like_btn = widgets.Button(
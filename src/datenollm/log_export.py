@@ -0,0 +1,194 @@
+# Columnar export of Gradio flagged logs for analytics
+#
+# Conversations of flagged log CSV are flattened into turns (user question
+# and assistant answer) and written as Parquet or Arrow IPC part files into
+# a dataset directory. Export is incremental: every run writes only rows
+# added to CSV since the previous run.
+#
+# Requires pyarrow (and pandas for loading as DataFrame):
+#   pip install datenollm[analytics]
+
+import json
+import logging
+import os
+
+from .log_index import FlaggedLogIndex
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = '_export_state.json'
+FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise ImportError("Flagged log export requires pyarrow: pip install pyarrow")
+
+def turns_schema():
+    """Arrow schema of flagged log turns"""
+    pa = _pyarrow()
+    return pa.schema([
+        ('row', pa.int64()),            # CSV row number
+        ('index', pa.int64()),          # 'index' column
+        ('turn', pa.int32()),           # Turn number in conversation
+        ('last', pa.bool_()),           # Last (flagged) turn of conversation
+        ('question', pa.string()),
+        ('answer', pa.string()),
+        ('like_dislike', pa.string()),  # Feedback from assistant metadata
+        ('value', pa.string()),         # 'value' column (like flag)
+        ('timestamp', pa.string()),
+        ('metadata', pa.string()),      # Assistant message metadata as JSON
+    ])
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def row_turns(row_number, row):
+    """Flattens flagged log CSV row into list of turn dicts"""
+    try:
+        conversation = json.loads(row.get('conversation') or '[]')
+    except json.JSONDecodeError:
+        conversation = []
+    timestamp = row.get('timestamp') or row.get('flag')
+
+    turns = []
+    question = None
+    for msg in conversation:
+        role = (msg.get('role') or '').lower()
+        if role in ('assistant', 'ai'):
+            metadata = msg.get('metadata') or {}
+            turns.append({
+                'row': row_number,
+                'index': _int(row.get('index')),
+                'turn': len(turns),
+                'last': False,
+                'question': question,
+                'answer': msg.get('content'),
+                'like_dislike': metadata.get('like_dislike'),
+                'value': row.get('value'),
+                'timestamp': timestamp,
+                'metadata': json.dumps(metadata, ensure_ascii=False) if metadata else None,
+            })
+            question = None
+        else:
+            question = msg.get('content')
+    if turns:
+        turns[-1]['last'] = True
+    return turns
+
+def _read_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'rows': 0, 'parts': 0}
+
+def _write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def _part_files(out_dir, format):
+    return sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir)
+                  if name.startswith('part-') and name.endswith(FORMATS[format]))
+
+def _write_table(table, path, format):
+    pa = _pyarrow()
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+def export_flagged_log(csv_path, out_dir, format='parquet', batch_rows=100000):
+    """
+    Exports new rows of flagged log CSV as turns to columnar dataset
+
+    Args:
+        csv_path (str): Path to flagged log CSV file
+        out_dir (str): Dataset directory
+        format (str): 'parquet' or 'arrow' (Arrow IPC)
+        batch_rows (int): Maximum number of turns in one part file
+
+    Returns:
+        int: Number of exported turns
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format: {format}")
+    pa = _pyarrow()
+    schema = turns_schema()
+    os.makedirs(out_dir, exist_ok=True)
+
+    state = _read_state(out_dir)
+    if state.get('format', format) != format:
+        raise ValueError(f"Dataset {out_dir} is in {state['format']} format")
+    log_index = FlaggedLogIndex(csv_path)
+    first_hash = log_index.first_hash.hex()
+    replaced = state['rows'] and state.get('first_hash', first_hash) != first_hash
+    if replaced or len(log_index) < state['rows']:
+        # CSV was truncated or replaced, exported parts don't match it
+        logger.warning(f"{csv_path} was replaced or truncated, exporting from start")
+        for path in _part_files(out_dir, state.get('format', format)):
+            os.remove(path)
+        state = {'rows': 0, 'parts': 0}
+
+    exported = 0
+    turns = []
+
+    def flush(next_row):
+        nonlocal turns, exported
+        if turns:
+            table = pa.Table.from_pylist(turns, schema=schema)
+            path = os.path.join(out_dir, f"part-{state['parts']:05d}{FORMATS[format]}")
+            _write_table(table, path, format)
+            state['parts'] += 1
+            exported += len(turns)
+            turns = []
+        state['rows'] = next_row
+        state['format'] = format
+        state['first_hash'] = first_hash
+        _write_state(out_dir, state)
+
+    next_row = state['rows']
+    for row_number, row in log_index.iter_rows(state['rows']):
+        turns.extend(row_turns(row_number, row))
+        next_row = row_number + 1
+        if len(turns) >= batch_rows:
+            flush(next_row)
+    flush(next_row)
+
+    logger.debug(f'Exported {exported} turns from {csv_path} to {out_dir}')
+    return exported
+
+def load_flagged_log(out_dir, as_pandas=True):
+    """
+    Loads exported flagged log turns
+
+    Returns:
+        pandas.DataFrame or pyarrow.Table with turns
+    """
+    _pyarrow()
+    import pyarrow.dataset as ds
+
+    state = _read_state(out_dir)
+    format = state.get('format', 'parquet')
+    files = _part_files(out_dir, format)
+    dataset = ds.dataset(files, schema=turns_schema(),
+                         format='parquet' if format == 'parquet' else 'ipc')
+    table = dataset.to_table()
+    if as_pandas:
+        return table.to_pandas()
+    return table
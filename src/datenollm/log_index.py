@@ -0,0 +1,319 @@
+# Random access to Gradio flagged log CSV files
+#
+# Sidecar index file (<log.csv>.idx) keeps the byte offset and the value of
+# 'index' column of every CSV row. It is built once and then extended
+# incrementally as the CSV grows, so row lookup is a seek and a row parse.
+# Updates of the sidecar file hold its lock (<log.csv>.idx.lock).
+# The last row without trailing newline is indexed when the CSV size hasn't
+# changed since the previous update, otherwise it's still being written.
+
+import csv
+import hashlib
+import io
+import logging
+import os
+import struct
+from array import array
+
+from .file_utils import file_lock
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'DNLI'
+INDEX_VERSION = 2
+# magic, version, indexed CSV size, data start (end of header row), rows,
+# hash of the first data row (detects a replaced CSV file)
+INDEX_HEADER = struct.Struct('<4sIQQQ8s')
+# Row record: CSV offset, 'index' column value
+INDEX_RECORD = struct.Struct('<Qq')
+NO_INDEX = -1
+NO_HASH = bytes(8)
+
+
+def _records(f, start, final=False):
+    """
+    Yields (offset, row bytes) of complete CSV records starting at offset
+
+    The last record without trailing newline is yielded only if final is
+    true, otherwise it's treated as still being written.
+    """
+    f.seek(start)
+    offset = start
+    record = b''
+    quotes = 0
+    for line in iter(f.readline, b''):
+        if not line.endswith(b'\n'):
+            quotes += line.count(b'"')
+            if final and quotes % 2 == 0:
+                yield offset, record + line
+            return
+        record += line
+        quotes += line.count(b'"')
+        # Newline inside quoted field keeps quotes count odd
+        if quotes % 2 == 0:
+            yield offset, record
+            offset += len(record)
+            record = b''
+            quotes = 0
+
+
+def _parse_row(fieldnames, data, encoding='utf-8'):
+    reader = csv.DictReader(io.StringIO(data.decode(encoding)),
+                            fieldnames=fieldnames)
+    return next(reader)
+
+
+def _row_hash(record):
+    return hashlib.blake2b(record, digest_size=8).digest()
+
+
+class FlaggedLogIndex:
+    """
+    Offset index of flagged log CSV file
+
+    The index is kept in memory if the sidecar file can't be written
+    (e.g. read-only log directory).
+
+    Usage:
+        log_index = FlaggedLogIndex('.gradio/flagged/log.csv')
+        row = log_index.get_row(10)            # by row number
+        row = log_index.get_row_by_index(42)   # by 'index' column
+    """
+    def __init__(self, csv_path, index_path=None, encoding='utf-8'):
+        self.csv_path = csv_path
+        self.index_path = index_path or f'{csv_path}.idx'
+        self.encoding = encoding
+        self.fieldnames = None
+        self.data_start = 0
+        self.first_hash = NO_HASH
+        # In-memory index: [indexed size, rows, first row hash, records]
+        self._memory = None
+        # CSV size when the last row without trailing newline was seen
+        self._tail_size = None
+        # 'index' column value -> last row number, rows included in it
+        self._lookup = None
+        self._lookup_rows = 0
+        self.update()
+
+    def _read_header(self):
+        # Returns data start offset, sets fieldnames and first row hash
+        with open(self.csv_path, 'rb') as f:
+            records = _records(f, 0)
+            for offset, record in records:
+                self.fieldnames = next(csv.reader(
+                    io.StringIO(record.decode(self.encoding))))
+                self.first_hash = NO_HASH
+                for _, first in records:
+                    self.first_hash = _row_hash(first)
+                    break
+                return offset + len(record)
+        return None
+
+    def _scan(self, start, csv_size):
+        """Returns (packed records, number of rows, indexed size) from offset"""
+        added = 0
+        records = []
+        indexed_size = start
+        # The last row is complete if the CSV hasn't grown since it was seen
+        final = csv_size == self._tail_size
+        with open(self.csv_path, 'rb') as f:
+            for offset, record in _records(f, start, final):
+                index = NO_INDEX
+                try:
+                    row = _parse_row(self.fieldnames, record, self.encoding)
+                    index = int(row.get('index') or NO_INDEX)
+                except (ValueError, csv.Error):
+                    pass
+                records.append(INDEX_RECORD.pack(offset, index))
+                indexed_size = offset + len(record)
+                added += 1
+        self._tail_size = csv_size if indexed_size < csv_size else None
+        return b''.join(records), added, indexed_size
+
+    def _unterminated(self, indexed_size, csv_size):
+        # Last indexed row had no trailing newline, but the CSV has grown
+        if indexed_size >= csv_size or indexed_size <= self.data_start:
+            return False
+        with open(self.csv_path, 'rb') as f:
+            f.seek(indexed_size - 1)
+            return f.read(1) != b'\n'
+
+    def _valid(self, size, start, rows, first_hash, data_start, csv_size):
+        # CSV truncated or replaced: rebuild index
+        return start == data_start and size <= csv_size \
+            and (rows == 0 or first_hash == self.first_hash)
+
+    def update(self):
+        """Indexes CSV rows added since the last update"""
+        data_start = self._read_header()
+        if data_start is None:
+            # Empty file or incomplete header
+            self.fieldnames = None
+            return 0
+        csv_size = os.path.getsize(self.csv_path)
+        if self._memory is None:
+            try:
+                # Concurrent updates (e.g. several 'dateno-like' runs) would
+                # corrupt the sidecar file
+                with file_lock(self.index_path):
+                    return self._update_file(data_start, csv_size)
+            except OSError as e:
+                logger.warning(f"Can't write index {self.index_path}, "
+                               f"indexing {self.csv_path} in memory: {e}")
+                self._memory = [data_start, 0, NO_HASH, b'']
+        return self._update_memory(data_start, csv_size)
+
+    def _update_memory(self, data_start, csv_size):
+        indexed_size, rows, first_hash, records = self._memory
+        if not self._valid(indexed_size, self.data_start, rows, first_hash,
+                           data_start, csv_size):
+            indexed_size, rows, records = data_start, 0, b''
+            self._lookup = None
+        self.data_start = data_start
+        if self._unterminated(indexed_size, csv_size):
+            # Index the last row again from its start
+            rows -= 1
+            indexed_size = INDEX_RECORD.unpack_from(
+                records, rows * INDEX_RECORD.size)[0]
+            records = records[:rows * INDEX_RECORD.size]
+            self._lookup = None
+        data, added, indexed_size = self._scan(indexed_size, csv_size)
+        self._memory = [indexed_size, rows + added, self.first_hash,
+                        records + data]
+        return added
+
+    def _update_file(self, data_start, csv_size):
+        indexed_size = data_start
+        rows = 0
+        valid = False
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+            if len(header) == INDEX_HEADER.size:
+                magic, version, size, start, rows, first_hash = \
+                    INDEX_HEADER.unpack(header)
+                valid = magic == INDEX_MAGIC and version == INDEX_VERSION \
+                    and self._valid(size, start, rows, first_hash,
+                                    data_start, csv_size)
+                if valid:
+                    indexed_size = size
+        if not valid:
+            logger.debug(f'Building index {self.index_path}')
+            rows = 0
+            self._lookup = None
+            with open(self.index_path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                          data_start, data_start, rows,
+                                          self.first_hash))
+        self.data_start = data_start
+        if self._unterminated(indexed_size, csv_size):
+            # Index the last row again from its start, its record is dropped
+            rows -= 1
+            with open(self.index_path, 'rb') as f:
+                f.seek(INDEX_HEADER.size + rows * INDEX_RECORD.size)
+                indexed_size = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))[0]
+            self._lookup = None
+
+        if indexed_size >= csv_size:
+            return 0
+
+        data, added, indexed_size = self._scan(indexed_size, csv_size)
+        with open(self.index_path, 'r+b') as f:
+            # Drop records of interrupted update, header is written last
+            f.seek(INDEX_HEADER.size + rows * INDEX_RECORD.size)
+            f.truncate()
+            f.write(data)
+            f.seek(0)
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                      indexed_size, data_start, rows + added,
+                                      self.first_hash))
+        logger.debug(f'Indexed {added} rows of {self.csv_path}')
+        return added
+
+    def __len__(self):
+        if self._memory is not None:
+            return self._memory[1]
+        if not os.path.exists(self.index_path):
+            return 0
+        with open(self.index_path, 'rb') as f:
+            header = f.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size:
+            return 0
+        return INDEX_HEADER.unpack(header)[4]
+
+    def _record(self, row_number):
+        if self._memory is not None:
+            return INDEX_RECORD.unpack_from(self._memory[3],
+                                            row_number * INDEX_RECORD.size)
+        with open(self.index_path, 'rb') as f:
+            f.seek(INDEX_HEADER.size + row_number * INDEX_RECORD.size)
+            return INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+
+    def get_row(self, row_number):
+        """Returns CSV row (dict) by its number, None if there is no such row"""
+        if row_number < 0 or row_number >= len(self):
+            return None
+        offset, index = self._record(row_number)
+        with open(self.csv_path, 'rb') as f:
+            for _, record in _records(f, offset, final=True):
+                return _parse_row(self.fieldnames, record, self.encoding)
+        return None
+
+    def iter_rows(self, start_row=0):
+        """Yields (row number, CSV row dict) of indexed rows starting from start_row"""
+        rows = len(self)
+        if start_row < 0 or start_row >= rows:
+            return
+        offset, index = self._record(start_row)
+        with open(self.csv_path, 'rb') as f:
+            for row_number, (_, record) in enumerate(_records(f, offset, final=True),
+                                                     start_row):
+                if row_number >= rows:
+                    break
+                yield row_number, _parse_row(self.fieldnames, record, self.encoding)
+
+    def _index_data(self, start_row=0, stop_row=None):
+        # Packed records of rows [start_row, stop_row)
+        if stop_row is None:
+            stop_row = len(self)
+        if self._memory is not None:
+            return self._memory[3][start_row * INDEX_RECORD.size:
+                                   stop_row * INDEX_RECORD.size]
+        with open(self.index_path, 'rb') as f:
+            f.seek(INDEX_HEADER.size + start_row * INDEX_RECORD.size)
+            return f.read((stop_row - start_row) * INDEX_RECORD.size)
+
+    def index_values(self):
+        """Returns array of 'index' column values of all rows"""
+        values = array('q')
+        for offset, index in INDEX_RECORD.iter_unpack(self._index_data()):
+            values.append(index)
+        return values
+
+    def find_index(self, index):
+        """Returns row number of the last row with the given 'index' column value"""
+        rows = len(self)
+        if self._lookup is None or rows < self._lookup_rows:
+            self._lookup = {}
+            self._lookup_rows = 0
+        if rows > self._lookup_rows:
+            # Only rows indexed since the last lookup are added
+            data = self._index_data(self._lookup_rows, rows)
+            for row_number, (offset, value) in enumerate(
+                    INDEX_RECORD.iter_unpack(data), self._lookup_rows):
+                if value != NO_INDEX:
+                    self._lookup[value] = row_number
+            self._lookup_rows = rows
+        row_number = self._lookup.get(index)
+        if row_number is not None and self._record(row_number)[1] != index:
+            # Sidecar index was rebuilt by another process
+            self._lookup = None
+            return self.find_index(index)
+        return row_number
+
+    def get_row_by_index(self, index):
+        """Returns CSV row (dict) by 'index' column value"""
+        row_number = self.find_index(index)
+        if row_number is None:
+            return None
+        return self.get_row(row_number)
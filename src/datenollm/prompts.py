@@ -0,0 +1,249 @@
+# Prompt templates with current date/time placeholders
+#
+# Templates are compiled once into literal parts and placeholders
+# ({datetime}, {year}, {datetime_full}), prompt files are re-read only when
+# their modification time changes. Rendered prompts are cached for the
+# current second, so getting a prompt on every request costs no file I/O
+# and no string scanning.
+#
+# Optional environment variables:
+# DATENOLLM_PROMPT_PATH - Default prompt file (default: 'prompt.md')
+# DATENOLLM_PROMPT_DIR - Directory of named prompts, <name>.md files (default: none)
+# DATENOLLM_PROMPT_CHECK_INTERVAL - Seconds between prompt file change checks (default: 1)
+# DATENOLLM_PROMPT_KEY_INTERVAL - Seconds {datetime_full} is rounded down to in
+#   response cache and request dedup keys, 0 keeps exact time (default: 3600)
+
+import datetime
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = 'default'
+PLACEHOLDER_RE = re.compile(r'\{(datetime_full|datetime|year)\}')
+# Rendered {datetime_full} value
+DATETIME_FULL_RE = re.compile(r'\b(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) GMT\b')
+DATETIME_FULL_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+default_prompt_path = os.environ.get('DATENOLLM_PROMPT_PATH', 'prompt.md')
+default_prompt_dir = os.environ.get('DATENOLLM_PROMPT_DIR')
+try:
+    default_check_interval = float(os.environ['DATENOLLM_PROMPT_CHECK_INTERVAL'])
+except (KeyError, ValueError):
+    default_check_interval = 1.0
+try:
+    default_key_interval = int(os.environ['DATENOLLM_PROMPT_KEY_INTERVAL'])
+except (KeyError, ValueError):
+    default_key_interval = 3600
+
+
+class PromptClock:
+    """Current GMT date/time placeholder values, computed once per second"""
+    def __init__(self):
+        self._second = None
+        self._values = None
+        self._lock = threading.Lock()
+
+    def values(self, now=None):
+        """Returns (second, placeholder values) for the current second"""
+        if now is None:
+            now = time.time()
+        second = int(now)
+        with self._lock:
+            if second != self._second:
+                current = datetime.datetime.fromtimestamp(second, datetime.timezone.utc)
+                self._values = {
+                    'datetime': current.strftime("%Y-%m-%d"),
+                    'year': current.strftime("%Y"),
+                    'datetime_full': current.strftime(f"{DATETIME_FULL_FORMAT} GMT"),
+                }
+                self._second = second
+            return self._second, self._values
+
+
+clock = PromptClock()
+
+
+class PromptTemplate:
+    """
+    Compiled prompt template
+
+    Usage:
+        template = PromptTemplate('Today is {datetime}.')
+        prompt = template.render()
+    """
+    def __init__(self, text, clock=clock):
+        self.text = text
+        self.clock = clock
+        # Literal parts alternate with placeholder names
+        self.parts = PLACEHOLDER_RE.split(text)
+        self._rendered = (None, text)
+
+    @property
+    def static(self):
+        return len(self.parts) == 1
+
+    def render(self, now=None):
+        """Returns prompt with placeholders replaced by current date/time"""
+        if self.static:
+            return self.text
+        second, values = self.clock.values(now)
+        rendered_second, rendered = self._rendered
+        if rendered_second == second:
+            return rendered
+        parts = self.parts
+        rendered = ''.join(
+            values[part] if i % 2 else part for i, part in enumerate(parts))
+        self._rendered = (second, rendered)
+        return rendered
+
+
+@functools.lru_cache(maxsize=64)
+def compile_prompt(text):
+    """Returns compiled template of prompt text, shared by equal texts"""
+    return PromptTemplate(text)
+
+def render_prompt(text):
+    """Renders date/time placeholders of prompt text"""
+    if not text or '{' not in text:
+        return text
+    return compile_prompt(text).render()
+
+def prompt_key_text(prompt, interval=None):
+    """
+    Returns rendered prompt text used in request keys
+
+    {datetime_full} values change every second, so they are rounded down to
+    interval seconds. Requests within one interval share cached responses
+    and in-flight LLM calls, even though their prompts differ in time.
+    """
+    if interval is None:
+        interval = default_key_interval
+    if not prompt or interval <= 1 or ' GMT' not in prompt:
+        return prompt
+
+    def round_down(match):
+        current = datetime.datetime.strptime(match.group(1), DATETIME_FULL_FORMAT)
+        current = current.replace(tzinfo=datetime.timezone.utc)
+        second = int(current.timestamp()) // interval * interval
+        current = datetime.datetime.fromtimestamp(second, datetime.timezone.utc)
+        return current.strftime(f"{DATETIME_FULL_FORMAT} GMT")
+
+    return DATETIME_FULL_RE.sub(round_down, prompt)
+
+
+class _PromptFile:
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.template = None
+        self.checked = 0.0
+
+    def load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self.template is not None:
+                logger.warning(f"Prompt file {self.path} removed, keeping loaded prompt")
+            return
+        if mtime == self.mtime:
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.template = PromptTemplate(f.read())
+        self.mtime = mtime
+        logger.debug(f'Prompt {self.path} loaded')
+
+
+class PromptRegistry:
+    """
+    Named prompt templates
+
+    Prompts are registered from text or from files. Prompt files are
+    checked for changes at most every check_interval seconds, on access.
+
+    Usage:
+        prompts = PromptRegistry()
+        prompts.register_file('default', 'prompt.md')
+        prompts.register('short', 'Answer briefly. Today is {datetime}.')
+        prompt = prompts.render('default')
+    """
+    def __init__(self, check_interval=None):
+        if check_interval is None:
+            check_interval = default_check_interval
+        self.check_interval = check_interval
+        self._templates = {}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, text):
+        """Registers prompt template text"""
+        with self._lock:
+            self._files.pop(name, None)
+            self._templates[name] = PromptTemplate(text)
+
+    def register_file(self, name, path):
+        """Registers prompt template file, path is resolved now"""
+        prompt_file = _PromptFile(os.path.abspath(path))
+        prompt_file.load()
+        prompt_file.checked = time.monotonic()
+        with self._lock:
+            self._templates.pop(name, None)
+            self._files[name] = prompt_file
+
+    def register_dir(self, directory, extension='.md'):
+        """Registers every <name><extension> file of directory as prompt <name>"""
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            logger.warning(f"Prompt directory {directory} not found")
+            return
+        for file_name in names:
+            if file_name.endswith(extension):
+                self.register_file(file_name[:-len(extension)],
+                                   os.path.join(directory, file_name))
+
+    def names(self):
+        with self._lock:
+            return sorted(set(self._templates) | set(self._files))
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._templates or name in self._files
+
+    def get(self, name=DEFAULT_PROMPT):
+        """Returns compiled template of named prompt, None if there is none"""
+        with self._lock:
+            template = self._templates.get(name)
+            if template is not None:
+                return template
+            prompt_file = self._files.get(name)
+            if prompt_file is None:
+                return None
+            now = time.monotonic()
+            if now - prompt_file.checked >= self.check_interval:
+                prompt_file.checked = now
+                try:
+                    prompt_file.load()
+                except OSError as e:
+                    logger.error(f"Error loading prompt {prompt_file.path}: {e}")
+            return prompt_file.template
+
+    def render(self, name=DEFAULT_PROMPT, default=None):
+        """Returns named prompt with current date/time, default if there is none"""
+        template = self.get(name)
+        if template is None:
+            return default
+        return template.render()
+
+
+def create_default_registry():
+    """Creates registry with prompt file as 'default' and prompt directory"""
+    prompts = PromptRegistry()
+    prompts.register_file(DEFAULT_PROMPT, default_prompt_path)
+    if default_prompt_dir:
+        prompts.register_dir(default_prompt_dir)
+    return prompts
@@ -7,16 +7,54 @@
 # OPENAI_API_TEMPERATURE - Generation temperature (default: 0.7)
 # OPENAI_API_TOP_P - Nucleus sampling parameter (default: 0.95)
 # OPENAI_API_BASE - API base URL (default: "https://openrouter.ai/api/v1")
+# OPENAI_API_POOL_SIZE - Maximum number of cached LLM clients (default: 16)
+# OPENAI_API_MAX_CONCURRENCY - Maximum in-flight async LLM calls per API base URL (default: 64)
+# DATENOLLM_FILTER_TURNS - Number of LLM turns in llm_filter, >1 enables refinement (default: 1)
+# DATENOLLM_FILTER_WORKERS - Number of chunks filtered in parallel by llm_filter (default: 4)
+# DATENOLLM_FILTER_RETRIES - Retries of llm_filter chunk with invalid response (default: 1)
+# DATENOLLM_LLM_CACHE - llm_query response cache backend: memory, sqlite or none (default: memory)
+# DATENOLLM_LLM_CACHE_PATH - SQLite response cache path (default: '.cache/datenollm/llm_cache.sqlite')
+# DATENOLLM_LLM_CACHE_SIZE - Maximum number of cached responses (default: 1024)
+# DATENOLLM_LLM_CACHE_TTL - Cached response time to live in seconds (default: 3600)
+# DATENOLLM_LLM_CACHE_SAMPLED - Cache responses generated with temperature > 0 (default: false)
+# DATENOLLM_PROMPT_PATH, DATENOLLM_PROMPT_DIR - Default and named prompt files (see prompts.py)
+# DATENOLLM_PROMPT_KEY_INTERVAL - Prompt time precision of response cache keys (see prompts.py)
+# DATENOLLM_ALLOW_PROMPT_OVERRIDE - Use prompt text sent by callers of /ask and filter (default: false)
 # DATENOLLM_DEBUG - Set logging level (INFO, DEBUG, WARNING, ERROR, CRITICAL, default: INFO)
 
+import asyncio
+import contextvars
 import json
 import os
 import re
 import logging
+import threading
+import typing
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_openai import ChatOpenAI
 from langchain.schema import AIMessage, HumanMessage
 
+from .cache import SingleFlight, create_cache, default_cache_dir, make_key
+from .history import HistoryPolicy
+from .json_stream import iter_stream_items
+from .prompts import (
+    DEFAULT_PROMPT,
+    create_default_registry,
+    prompt_key_text,
+    render_prompt,
+)
+from .filter_utils import (
+    chunk_data,
+    default_filter_fields,
+    default_token_budget,
+    dumps_compact,
+    hit_ids,
+    merge_results,
+)
+
 # Configure logging
 log_level = getattr(logging, os.environ.get('DATENOLLM_DEBUG', 'INFO').upper(), logging.INFO)
 logging.basicConfig(
@@ -26,12 +64,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Defaults setting
-try:
-    with open('prompt.md') as f:
-        default_prompt = f.read()
-except FileNotFoundError:
-    default_prompt = ""
-    
 try:
     default_model = os.environ['OPENAI_API_MODEL']
 except KeyError:
@@ -63,70 +95,287 @@ except KeyError:
 if not default_flagging_dir:
     default_flagging_dir = ".gradio/flagged"
 
+try:
+    default_pool_size = int(os.environ['OPENAI_API_POOL_SIZE'])
+except:
+    default_pool_size = 16
+try:
+    default_max_concurrency = int(os.environ['OPENAI_API_MAX_CONCURRENCY'])
+except:
+    default_max_concurrency = 64
+try:
+    default_filter_turns = int(os.environ['DATENOLLM_FILTER_TURNS'])
+except:
+    default_filter_turns = 1
+try:
+    default_filter_workers = int(os.environ['DATENOLLM_FILTER_WORKERS'])
+except:
+    default_filter_workers = 4
+try:
+    default_filter_retries = int(os.environ['DATENOLLM_FILTER_RETRIES'])
+except:
+    default_filter_retries = 1
+
+default_llm_cache = os.environ.get('DATENOLLM_LLM_CACHE', 'memory').lower()
+default_llm_cache_path = os.environ.get(
+    'DATENOLLM_LLM_CACHE_PATH',
+    os.path.join(default_cache_dir, 'llm_cache.sqlite'))
+try:
+    default_llm_cache_size = int(os.environ['DATENOLLM_LLM_CACHE_SIZE'])
+except:
+    default_llm_cache_size = 1024
+try:
+    default_llm_cache_ttl = float(os.environ['DATENOLLM_LLM_CACHE_TTL'])
+except:
+    default_llm_cache_ttl = 3600
+default_llm_cache_sampled = os.environ.get(
+    'DATENOLLM_LLM_CACHE_SAMPLED', '').lower() in ('1', 'true', 'yes')
+default_allow_prompt_override = os.environ.get(
+    'DATENOLLM_ALLOW_PROMPT_OVERRIDE', '').lower() in ('1', 'true', 'yes')
+
+filter_refine_message = "Check your previous answer against the data above and return the corrected result in the same JSON format."
+
+# Usage of the current Server call (per thread / asyncio task)
+_llm_usage = contextvars.ContextVar('datenollm_llm_usage', default=None)
+
+
+class LLMPool:
+    """LRU pool of ChatOpenAI clients.
+
+    Clients are keyed by (openai_api_base, model, max_tokens, temperature,
+    top_p), so repeated requests with the same settings reuse the same
+    client together with its HTTP connection pool.
+    """
+    def __init__(self, max_size=None):
+        if not max_size:
+            max_size = default_pool_size
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, openai_api_base, model, max_tokens, temperature, top_p):
+        key = (openai_api_base, model, max_tokens, temperature, top_p)
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return llm
+
+            self.misses += 1
+            llm = ChatOpenAI(
+                openai_api_base = openai_api_base,
+                model = model,
+                max_tokens = max_tokens,
+                temperature=temperature,
+                top_p = top_p,
+            )
+            self._clients[key] = llm
+            while len(self._clients) > self.max_size:
+                evicted_key, _ = self._clients.popitem(last=False)
+                self.evictions += 1
+                logger.debug(f'LLM pool evicted {evicted_key=}')
+            return llm
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class LLMUsage:
+    """LLM invocations and token counters of a single Server call"""
+    def __init__(self, name):
+        self.name = name
+        self.invocations = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, response, invocation=True):
+        usage = getattr(response, 'usage_metadata', None) or {}
+        with self._lock:
+            if invocation:
+                self.invocations += 1
+            self.input_tokens += usage.get('input_tokens', 0)
+            self.output_tokens += usage.get('output_tokens', 0)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'invocations': self.invocations,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+        }
+
 
 class Server:
     def __init__(self, validator=None,
                  prompt=None, model=None, max_tokens=None,
                  temperature=None, top_p=None,
-                 openai_api_base=None, flagging_dir=None):
-        if not prompt:  # Use default prompt if not provided
-            self.prompt = default_prompt
+                 openai_api_base=None, flagging_dir=None, pool_size=None,
+                 max_concurrency=None, filter_turns=None,
+                 filter_fields=None, filter_token_budget=None,
+                 filter_workers=None, filter_retries=None,
+                 cache=None, cache_sampled=None,
+                 history_policy=None, prompts=None,
+                 allow_prompt_override=None):
+        # Prompt templates, the default one is DATENOLLM_PROMPT_PATH file
+        if prompts is None:
+            prompts = create_default_registry()
+        self.prompts = prompts
+        if prompt:
+            self.prompt = prompt
+        # Callers pick named prompts, their own prompt text is used only if allowed
+        if allow_prompt_override is None:
+            allow_prompt_override = default_allow_prompt_override
+        self.allow_prompt_override = allow_prompt_override
         if not model:  # Use default model if not provided
-            self.model = default_model
-        if not max_tokens:  # Use default max_tokens if not provided
-            self.max_tokens = default_max_tokens
-        if not temperature:  # Use default temperature if not provided
-            self.temperature = default_temperature
-        if not top_p:  # Use default top_p if not provided
-            self.top_p = default_top_p
+            model = default_model
+        self.model = model
+        # temperature=0 is a valid (deterministic) setting
+        if max_tokens is None:  # Use default max_tokens if not provided
+            max_tokens = default_max_tokens
+        self.max_tokens = max_tokens
+        if temperature is None:  # Use default temperature if not provided
+            temperature = default_temperature
+        self.temperature = temperature
+        if top_p is None:  # Use default top_p if not provided
+            top_p = default_top_p
+        self.top_p = top_p
         if not openai_api_base:  # Use default openai_api_base if not provided
-            self.openai_api_base = default_openai_api_base
+            openai_api_base = default_openai_api_base
+        self.openai_api_base = openai_api_base
         if not flagging_dir:  # Use default flagging_dir if not provided
-            self.flagging_dir = default_flagging_dir
+            flagging_dir = default_flagging_dir
+        self.flagging_dir = flagging_dir
         logger.debug(f'{self.flagging_dir=}')
         self.validator = validator
+        self._item_validators = {}
+        self.llm_pool = LLMPool(pool_size)
+        if not max_concurrency:
+            max_concurrency = default_max_concurrency
+        self.max_concurrency = max_concurrency
+        # Event loop -> {API base URL: semaphore}, semaphores are bound to a loop
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._semaphores_lock = threading.Lock()
+        if not filter_turns:
+            filter_turns = default_filter_turns
+        self.filter_turns = filter_turns
+        if not filter_fields:
+            filter_fields = default_filter_fields
+        self.filter_fields = filter_fields
+        if not filter_token_budget:
+            filter_token_budget = default_token_budget
+        self.filter_token_budget = filter_token_budget
+        if not filter_workers:
+            filter_workers = default_filter_workers
+        self.filter_workers = filter_workers
+        if filter_retries is None:
+            filter_retries = default_filter_retries
+        self.filter_retries = filter_retries
+        if cache is None:
+            cache = create_cache(default_llm_cache,
+                                 path=default_llm_cache_path,
+                                 max_size=default_llm_cache_size,
+                                 ttl=default_llm_cache_ttl,
+                                 table='llm_cache')
+        elif not cache:
+            # cache=False / '' disables caching like 'none'
+            cache = None
+        elif isinstance(cache, str):
+            cache = create_cache(cache,
+                                 path=default_llm_cache_path,
+                                 max_size=default_llm_cache_size,
+                                 ttl=default_llm_cache_ttl,
+                                 table='llm_cache')
+        self.cache = cache
+        if cache_sampled is None:
+            cache_sampled = default_llm_cache_sampled
+        self.cache_sampled = cache_sampled
+        self.flight = SingleFlight()
+        if history_policy is None:
+            history_policy = HistoryPolicy.from_env()
+        self.history_policy = history_policy
+        self._usage_totals = {}
+        self._usage_lock = threading.Lock()
+
+    @property
+    def prompt(self):
+        """Default prompt with current date/time placeholders rendered"""
+        return self.prompts.render(DEFAULT_PROMPT, '')
+
+    @prompt.setter
+    def prompt(self, text):
+        self.prompts.register(DEFAULT_PROMPT, text)
+
+    def get_prompt(self, name=None):
+        """Returns named prompt (default prompt if there is no such one)"""
+        if not name:
+            return self.prompt
+        prompt = self.prompts.render(name)
+        if prompt is None:
+            logger.warning(f"Unknown prompt '{name}', using default prompt")
+            return self.prompt
+        return prompt
+
+    def _caller_prompt(self, prompt):
+        """Returns prompt text sent by caller if overriding is allowed"""
+        if not prompt:
+            return None
+        if not self.allow_prompt_override:
+            logger.debug('Caller prompt ignored, prompt override is not allowed')
+            return None
+        return render_prompt(prompt)
+
+    def get_llm(self, openai_api_base, model, max_tokens, temperature, top_p):
+        """Return a pooled LLM client for the given settings"""
+        return self.llm_pool.get(openai_api_base, model, max_tokens,
+                                 temperature, top_p)
+
+    def llm_pool_stats(self):
+        """Return LLM client pool counters"""
+        return self.llm_pool.stats()
 
     def clean_json_response(self, response_text):
         # Clean markdown blocks
         cleaned = re.sub(r'```json\s*', '', response_text)
         cleaned = re.sub(r'```\s*$', '', cleaned)
         return cleaned.strip()    
-    
-    def llm_query(self, message, history,
-                  prompt=None, model=None, max_tokens=None,
-                  temperature=None, top_p=None, openai_api_base=None):
+
+    def _llm_params(self, prompt=None, model=None, max_tokens=None,
+                    temperature=None, top_p=None, openai_api_base=None):
         if not prompt: # Use default prompt if not provided
             prompt = self.prompt
         if not model:  # Use default model if not provided
             model = self.model
-        if not max_tokens:  # Use default max_tokens if not provided
+        # temperature=0 requests deterministic (cacheable) responses
+        if max_tokens is None:  # Use default max_tokens if not provided
             max_tokens = self.max_tokens
-        if not temperature:  # Use default temperature if not provided
+        if temperature is None:  # Use default temperature if not provided
             temperature = self.temperature
-        if not top_p:  # Use default top_p if not provided
+        if top_p is None:  # Use default top_p if not provided
             top_p = self.top_p
         if not openai_api_base:  # Use default openai_api_base if not provided
             openai_api_base = self.openai_api_base
-        
-        logger.debug(f"llm_query() parameters:")
-        logger.debug(f'  {message=}')
-        logger.debug(f'  {history=}')
-        logger.debug(f'  {prompt=}')
-        logger.debug(f'  {model=}')
-        logger.debug(f'  {max_tokens=}')
-        logger.debug(f'  {temperature=}')
-        logger.debug(f'  {top_p=}')
-        logger.debug(f'  {openai_api_base=}')
+        return prompt, model, max_tokens, temperature, top_p, openai_api_base
 
-        llm = ChatOpenAI(
-            openai_api_base = openai_api_base,
-            model = model,
-            max_tokens = max_tokens,
-            temperature=temperature,
-            top_p = top_p,
-        )
-
-        history_langchain_format = [AIMessage(content=self.prompt),]
+    def _history2langchain(self, history, prompt=None):
+        if not prompt:
+            prompt = self.prompt
+        history_langchain_format = [AIMessage(content=prompt),]
         for msg in history:
             logger.debug(f'{msg=}')
             if msg['role'] == "user":
@@ -134,11 +383,22 @@ class Server:
                     HumanMessage(content=msg['content']))
             elif msg['role'] == "assistant":
                 history_langchain_format.append(AIMessage(content=msg['content']))
-        logger.debug(f'{message=}')
-        history_langchain_format.append(HumanMessage(content=message))
-        
-        response = llm.invoke(history_langchain_format)
-        response = self.clean_json_response(response.content)
+        return history_langchain_format
+
+    def _filter_message(self, message, data):
+        return f"""
+        # User query
+        {message}
+
+        # Data
+        ```json
+        {dumps_compact(data)}
+        ```
+        """
+
+    def _check_response(self, response):
+        """Clean and validate LLM response, returns (response, is_valid)"""
+        response = self.clean_json_response(response)
 
         if self.validator:
             # Responce validation
@@ -149,30 +409,72 @@ class Server:
                 logger.error(f"Validation error: {e}")
                 logger.error(f"Cleaned response: {response}")
                 response = {"question": "There seems to be something wrong with request processing. An invalid result was received. Try increasing 'Max new tokens' (max_tokens) parameter. If that doesn't help, contact support.", "queries": []}
-                return json.dumps(response)
-        
-        return response
+                return json.dumps(response), False
 
-    def llm_filter(self, message, history, data,
-                  prompt=None, model=None, max_tokens=None,
-                  temperature=None, top_p=None, openai_api_base=None):
-        if not prompt: # Use default prompt if not provided
-            prompt = self.prompt
-        if not model:  # Use default model if not provided
-            model = self.model
-        if not max_tokens:  # Use default max_tokens if not provided
-            max_tokens = self.max_tokens
-        if not temperature:  # Use default temperature if not provided
-            temperature = self.temperature
-        if not top_p:  # Use default top_p if not provided
-            top_p = self.top_p
-        if not openai_api_base:  # Use default openai_api_base if not provided
-            openai_api_base = self.openai_api_base
+        return response, True
 
-        logger.debug(f"llm_filter() parameters:")
+    def _item_validator(self, key):
+        """
+        Returns validation function of validator's `key` list items
+
+        None if there is no validator or `key` field is not a list.
+        """
+        if self.validator is None:
+            return None
+        if key in self._item_validators:
+            return self._item_validators[key]
+        validate = None
+        field = getattr(self.validator, 'model_fields', {}).get(key)
+        if field is not None:
+            # list[Query] or Optional[list[Query]]
+            for annotation in (field.annotation, *typing.get_args(field.annotation)):
+                if typing.get_origin(annotation) in (list, tuple, set) \
+                        and typing.get_args(annotation):
+                    from pydantic import TypeAdapter
+                    validate = TypeAdapter(
+                        typing.get_args(annotation)[0]).validate_python
+                    break
+        self._item_validators[key] = validate
+        return validate
+
+    def _validate_response(self, response):
+        return self._check_response(response)[0]
+
+    def _request_key(self, messages, model, max_tokens, temperature, top_p,
+                     openai_api_base):
+        """Returns key identifying LLM request"""
+        # Normalize whitespace, so that trivially different prompts share key,
+        # and the prompt time, so that the key doesn't change every second
+        messages = [(type(msg).__name__,
+                     ' '.join((prompt_key_text(msg.content) if i == 0
+                               else msg.content).split()))
+                    for i, msg in enumerate(messages)]
+        return make_key(openai_api_base, model, max_tokens, temperature,
+                        top_p, messages)
+
+    def _cache_key(self, request_key, temperature):
+        """Returns response cache key or None if response must not be cached"""
+        if self.cache is None:
+            return None
+        if temperature and temperature > 0 and not self.cache_sampled:
+            return None
+        return request_key
+
+    def cache_stats(self):
+        """Return llm_query response cache counters"""
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def flight_stats(self):
+        """Return number of llm_query calls and calls that shared a concurrent identical call"""
+        return self.flight.stats()
+
+    def _log_params(self, name, message, history, prompt, model, max_tokens,
+                    temperature, top_p, openai_api_base):
+        logger.debug(f"{name}() parameters:")
         logger.debug(f'  {message=}')
         logger.debug(f'  {history=}')
-        logger.debug(f'  {type(data)=} {data=}')
         logger.debug(f'  {prompt=}')
         logger.debug(f'  {model=}')
         logger.debug(f'  {max_tokens=}')
@@ -180,54 +482,372 @@ class Server:
         logger.debug(f'  {top_p=}')
         logger.debug(f'  {openai_api_base=}')
 
-        llm = ChatOpenAI(
-            openai_api_base = openai_api_base,
-            model = model,
-            max_tokens = max_tokens,
-            temperature=temperature,
-            top_p = top_p,
-        )
+    def _start_usage(self, name):
+        usage = LLMUsage(name)
+        _llm_usage.set(usage)
+        return usage
+
+    def _finish_usage(self, usage):
+        logger.debug(f'{usage.as_dict()=}')
+        with self._usage_lock:
+            totals = self._usage_totals.setdefault(usage.name, {
+                'calls': 0,
+                'invocations': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+            })
+            totals['calls'] += 1
+            totals['invocations'] += usage.invocations
+            totals['input_tokens'] += usage.input_tokens
+            totals['output_tokens'] += usage.output_tokens
+
+    def last_usage(self):
+        """Return LLM usage of the last call made in the current thread/task"""
+        usage = _llm_usage.get()
+        if usage is None:
+            return None
+        return usage.as_dict()
+
+    def usage_stats(self):
+        """Return accumulated LLM usage counters per Server method"""
+        with self._usage_lock:
+            return {name: dict(totals)
+                    for name, totals in self._usage_totals.items()}
+
+    def _append_filter_refinement(self, history_langchain_format, response, turn):
+        # Feed the previous answer back and ask the model to refine it
+        history_langchain_format.append(AIMessage(content=response.content))
+        history_langchain_format.append(HumanMessage(content=filter_refine_message))
+        logger.debug(f'llm_filter refinement turn {turn}')
+
+    def get_semaphore(self, openai_api_base):
+        """Return the asyncio concurrency limiter for an upstream base URL in the running loop"""
+        loop = asyncio.get_running_loop()
+        with self._semaphores_lock:
+            semaphores = self._semaphores.setdefault(loop, {})
+            semaphore = semaphores.get(openai_api_base)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                semaphores[openai_api_base] = semaphore
+            return semaphore
 
-        history_langchain_format = [AIMessage(content=self.prompt),]
-        for msg in history:
-            logger.debug(f'{msg=}')
-            if msg['role'] == "user":
-                history_langchain_format.append(
-                    HumanMessage(content=msg['content']))
-            elif msg['role'] == "assistant":
-                history_langchain_format.append(AIMessage(content=msg['content']))
+    def llm_query(self, message, history,
+                  prompt=None, model=None, max_tokens=None,
+                  temperature=None, top_p=None, openai_api_base=None):
+        prompt, model, max_tokens, temperature, top_p, openai_api_base = \
+            self._llm_params(prompt, model, max_tokens, temperature, top_p,
+                             openai_api_base)
+        self._log_params('llm_query', message, history, prompt, model,
+                         max_tokens, temperature, top_p, openai_api_base)
 
-        message = f"""
-        # User query
-        {message}
+        llm = self.get_llm(openai_api_base, model, max_tokens,
+                           temperature, top_p)
 
-        # Data
-        ```json
-        {json.dumps(data, indent=2)}
-        ```
+        history_langchain_format = self._history2langchain(history, prompt)
+        logger.debug(f'{message=}')
+        history_langchain_format.append(HumanMessage(content=message))
+        
+        usage = self._start_usage('llm_query')
+        request_key = self._request_key(history_langchain_format, model,
+                                        max_tokens, temperature, top_p,
+                                        openai_api_base)
+        cache_key = self._cache_key(request_key, temperature)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f'llm_query() cache hit {cache_key=}')
+                self._finish_usage(usage)
+                return cached
+
+        def query():
+            response = llm.invoke(history_langchain_format)
+            usage.add(response)
+            response, valid = self._check_response(response.content)
+            if cache_key is not None and valid:
+                self.cache.set(cache_key, response)
+            return response
+
+        # Concurrent identical requests share one LLM call
+        try:
+            return self.flight.do(request_key, query)
+        finally:
+            self._finish_usage(usage)
+
+    def llm_query_stream(self, message, history,
+                         prompt=None, model=None, max_tokens=None,
+                         temperature=None, top_p=None, openai_api_base=None):
         """
+        Streaming version of llm_query()
+
+        Yields the response accumulated so far as new tokens arrive, the
+        last yielded value is the cleaned and validated response.
+        """
+        prompt, model, max_tokens, temperature, top_p, openai_api_base = \
+            self._llm_params(prompt, model, max_tokens, temperature, top_p,
+                             openai_api_base)
+        self._log_params('llm_query_stream', message, history, prompt, model,
+                         max_tokens, temperature, top_p, openai_api_base)
+
+        llm = self.get_llm(openai_api_base, model, max_tokens,
+                           temperature, top_p)
+
+        history_langchain_format = self._history2langchain(history, prompt)
         logger.debug(f'{message=}')
+        history_langchain_format.append(HumanMessage(content=message))
 
+        usage = self._start_usage('llm_query_stream')
+        request_key = self._request_key(history_langchain_format, model,
+                                        max_tokens, temperature, top_p,
+                                        openai_api_base)
+        cache_key = self._cache_key(request_key, temperature)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f'llm_query_stream() cache hit {cache_key=}')
+                self._finish_usage(usage)
+                yield cached
+                return
+
+        content = ''
+        usage.invocations += 1
+        for chunk in llm.stream(history_langchain_format):
+            usage.add(chunk, invocation=False)
+            if chunk.content:
+                content += chunk.content
+                yield content
+        self._finish_usage(usage)
+
+        response, valid = self._check_response(content)
+        if cache_key is not None and valid:
+            self.cache.set(cache_key, response)
+        yield response
+
+    async def allm_query(self, message, history,
+                         prompt=None, model=None, max_tokens=None,
+                         temperature=None, top_p=None, openai_api_base=None):
+        """Async version of llm_query()"""
+        prompt, model, max_tokens, temperature, top_p, openai_api_base = \
+            self._llm_params(prompt, model, max_tokens, temperature, top_p,
+                             openai_api_base)
+        self._log_params('allm_query', message, history, prompt, model,
+                         max_tokens, temperature, top_p, openai_api_base)
+
+        llm = self.get_llm(openai_api_base, model, max_tokens,
+                           temperature, top_p)
+
+        history_langchain_format = self._history2langchain(history, prompt)
+        logger.debug(f'{message=}')
         history_langchain_format.append(HumanMessage(content=message))
 
-        response = llm.invoke(history_langchain_format)
+        usage = self._start_usage('allm_query')
+        request_key = self._request_key(history_langchain_format, model,
+                                        max_tokens, temperature, top_p,
+                                        openai_api_base)
+        cache_key = self._cache_key(request_key, temperature)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f'allm_query() cache hit {cache_key=}')
+                self._finish_usage(usage)
+                return cached
+
+        async def query():
+            async with self.get_semaphore(openai_api_base):
+                response = await llm.ainvoke(history_langchain_format)
+            usage.add(response)
+            response, valid = self._check_response(response.content)
+            if cache_key is not None and valid:
+                self.cache.set(cache_key, response)
+            return response
+
+        # Concurrent identical requests share one LLM call
+        try:
+            return await self.flight.ado(request_key, query)
+        finally:
+            self._finish_usage(usage)
+
+    def _filter_chunks(self, data, fields=None, token_budget=None,
+                       max_hits_per_chunk=None):
+        if not fields:
+            fields = self.filter_fields
+        if not token_budget:
+            token_budget = self.filter_token_budget
+        return chunk_data(data, token_budget=token_budget, fields=fields,
+                          max_hits=max_hits_per_chunk)
+
+    def _check_chunk_response(self, response):
+        """Returns (response, is_valid), response must be valid JSON"""
+        response, valid = self._check_response(response)
+        if valid and not self.validator:
+            try:
+                json.loads(response)
+            except json.JSONDecodeError as e:
+                logger.error(f"Invalid chunk response: {e}")
+                valid = False
+        return response, valid
+
+    def _merge_filter_responses(self, responses, chunks):
+        """
+        Merges (response, is_valid) of chunks
+
+        Chunks that stayed invalid after retries are listed under
+        'failed_chunks' of the merged result with '_id' of their hits,
+        so their hits are not silently lost.
+        """
+        if len(responses) == 1:
+            return responses[0][0]
+        results = []
+        failed = []
+        for number, ((response, valid), chunk) in enumerate(zip(responses, chunks)):
+            if valid:
+                results.append(json.loads(response))
+            else:
+                failed.append({'chunk': number, 'ids': hit_ids(chunk)})
+        if not results:
+            # Nothing to merge, return the error response
+            return responses[0][0]
+        merged = merge_results(results)
+        if failed:
+            logger.error(f"llm_filter(): {len(failed)} of {len(chunks)} chunks failed")
+            if isinstance(merged, dict):
+                merged['failed_chunks'] = failed
+        return json.dumps(merged, ensure_ascii=False)
+
+    def _filter_chunk(self, llm, history_langchain_format, message, chunk,
+                      filter_turns, usage):
+        history_langchain_format = list(history_langchain_format)
+        message = self._filter_message(message, chunk)
+        logger.debug(f'{message=}')
         history_langchain_format.append(HumanMessage(content=message))
 
-        response = llm.invoke(history_langchain_format)
-        response = self.clean_json_response(response.content)
+        for attempt in range(self.filter_retries + 1):
+            messages = list(history_langchain_format)
+            response = llm.invoke(messages)
+            usage.add(response)
+            for turn in range(1, filter_turns):
+                self._append_filter_refinement(messages, response, turn)
+                response = llm.invoke(messages)
+                usage.add(response)
+            response, valid = self._check_chunk_response(response.content)
+            if valid:
+                break
+            logger.warning(f'llm_filter(): invalid chunk response, {attempt=}')
+        return response, valid
+
+    async def _afilter_chunk(self, llm, history_langchain_format, message,
+                             chunk, filter_turns, usage, openai_api_base):
+        history_langchain_format = list(history_langchain_format)
+        message = self._filter_message(message, chunk)
+        logger.debug(f'{message=}')
+        history_langchain_format.append(HumanMessage(content=message))
 
-        if self.validator:
-            # Responce validation
-            try:
-                validated_data = self.validator.model_validate_json(response)
-                logger.debug(f'{validated_data=}')
-            except Exception as e:
-                logger.error(f"Validation error: {e}")
-                logger.error(f"Cleaned response: {response}")
-                response = {"question": "There seems to be something wrong with request processing. An invalid result was received. Try increasing 'Max new tokens' (max_tokens) parameter. If that doesn't help, contact support.", "queries": []}
-                return json.dumps(response)
+        for attempt in range(self.filter_retries + 1):
+            messages = list(history_langchain_format)
+            async with self.get_semaphore(openai_api_base):
+                response = await llm.ainvoke(messages)
+                usage.add(response)
+                for turn in range(1, filter_turns):
+                    self._append_filter_refinement(messages, response, turn)
+                    response = await llm.ainvoke(messages)
+                    usage.add(response)
+            response, valid = self._check_chunk_response(response.content)
+            if valid:
+                break
+            logger.warning(f'allm_filter(): invalid chunk response, {attempt=}')
+        return response, valid
 
-        return response
+    def llm_filter(self, message, history, data,
+                  prompt=None, model=None, max_tokens=None,
+                  temperature=None, top_p=None, openai_api_base=None,
+                  filter_turns=None, fields=None, token_budget=None,
+                  max_hits_per_chunk=None, workers=None):
+        """
+        Filter data with LLM
+
+        Data is split into chunks (map), chunks are filtered in parallel
+        by a bounded pool of workers and the per-chunk answers are merged
+        into one combined output (reduce).
+        """
+        prompt = self._caller_prompt(prompt)
+        prompt, model, max_tokens, temperature, top_p, openai_api_base = \
+            self._llm_params(prompt, model, max_tokens, temperature, top_p,
+                             openai_api_base)
+        logger.debug(f'  {type(data)=} {data=}')
+        self._log_params('llm_filter', message, history, prompt, model,
+                         max_tokens, temperature, top_p, openai_api_base)
+
+        llm = self.get_llm(openai_api_base, model, max_tokens,
+                           temperature, top_p)
+
+        history_langchain_format = self._history2langchain(history, prompt)
+
+        if not filter_turns:
+            filter_turns = self.filter_turns
+
+        if not workers:
+            workers = self.filter_workers
+
+        chunks = self._filter_chunks(data, fields, token_budget,
+                                     max_hits_per_chunk)
+        logger.debug(f'llm_filter(): {len(chunks)=} {workers=}')
+
+        usage = self._start_usage('llm_filter')
+        if len(chunks) == 1 or workers == 1:
+            responses = [self._filter_chunk(llm, history_langchain_format,
+                                            message, chunk, filter_turns, usage)
+                         for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                responses = list(executor.map(
+                    lambda chunk: self._filter_chunk(
+                        llm, history_langchain_format, message, chunk,
+                        filter_turns, usage),
+                    chunks))
+        self._finish_usage(usage)
+        return self._merge_filter_responses(responses, chunks)
+
+    async def allm_filter(self, message, history, data,
+                          prompt=None, model=None, max_tokens=None,
+                          temperature=None, top_p=None, openai_api_base=None,
+                          filter_turns=None, fields=None, token_budget=None,
+                          max_hits_per_chunk=None, workers=None):
+        """Async version of llm_filter()"""
+        prompt = self._caller_prompt(prompt)
+        prompt, model, max_tokens, temperature, top_p, openai_api_base = \
+            self._llm_params(prompt, model, max_tokens, temperature, top_p,
+                             openai_api_base)
+        logger.debug(f'  {type(data)=} {data=}')
+        self._log_params('allm_filter', message, history, prompt, model,
+                         max_tokens, temperature, top_p, openai_api_base)
+
+        llm = self.get_llm(openai_api_base, model, max_tokens,
+                           temperature, top_p)
+
+        history_langchain_format = self._history2langchain(history, prompt)
+
+        if not filter_turns:
+            filter_turns = self.filter_turns
+
+        if not workers:
+            workers = self.filter_workers
+
+        chunks = self._filter_chunks(data, fields, token_budget,
+                                     max_hits_per_chunk)
+        logger.debug(f'allm_filter(): {len(chunks)=} {workers=}')
+
+        usage = self._start_usage('allm_filter')
+        workers_semaphore = asyncio.Semaphore(workers)
+
+        async def filter_chunk(chunk):
+            async with workers_semaphore:
+                return await self._afilter_chunk(
+                    llm, history_langchain_format, message, chunk,
+                    filter_turns, usage, openai_api_base)
+
+        responses = await asyncio.gather(*[filter_chunk(chunk)
+                                           for chunk in chunks])
+        self._finish_usage(usage)
+        return self._merge_filter_responses(responses, chunks)
 
     def validate(self, response):
         # Responce validation
@@ -240,28 +860,79 @@ class Server:
                 logger.error(f"Cleaned response: {response}")
                 raise e
 
-    def ask(self,
-            message: str,
-            params: str,
-    ) -> str:
-        """Send query to LLM"""
+    def _ask_params(self, params):
         params_dict = json.loads(params)
-        llm_history = params_dict.get('history', [])
-        llm_prompt = params_dict.get('prompt', self.prompt)
+        # Request may narrow the history window, e.g. {"history_max_turns": 5},
+        # but not widen the server policy
+        policy = self.history_policy.narrow(
+            max_turns=params_dict.get('history_max_turns'),
+            max_tokens=params_dict.get('history_max_tokens'),
+            liked_only=params_dict.get('history_liked_only'),
+        )
+        llm_history = policy.apply(params_dict.get('history', []))
+        # Request may pick a named prompt, e.g. {"prompt_name": "short"}
+        llm_prompt = self._caller_prompt(params_dict.get('prompt')) \
+            or self.get_prompt(params_dict.get('prompt_name'))
         llm_model = params_dict.get('model', self.model)
         llm_max_tokens = params_dict.get('max_tokens', self.max_tokens)
         llm_temperature = params_dict.get('temperature', self.temperature)
         llm_top_p = params_dict.get('top_p', self.top_p)
+        return (llm_history, llm_prompt, llm_model, llm_max_tokens,
+                llm_temperature, llm_top_p)
 
-        response = self.llm_query(message, llm_history, llm_prompt, llm_model,
-                                llm_max_tokens, llm_temperature, llm_top_p)
-
+    def _ask_response(self, response):
         if type(response) is not str and self.validator:
             response = response.model_dump_json()
 
         logger.debug(f'{response=}')
         return response
 
+    def ask(self,
+            message: str,
+            params: str,
+    ) -> str:
+        """Send query to LLM"""
+        response = self.llm_query(message, *self._ask_params(params))
+        return self._ask_response(response)
+
+    async def aask(self,
+                   message: str,
+                   params: str,
+    ) -> str:
+        """Send query to LLM (async)"""
+        response = await self.allm_query(message, *self._ask_params(params))
+        return self._ask_response(response)
+
+    def ask_stream(self,
+                   message: str,
+                   params: str,
+    ):
+        """Send query to LLM, yields partial response while it's generated"""
+        for response in self.llm_query_stream(message, *self._ask_params(params)):
+            yield response
+
+    def ask_stream_queries(self,
+                           message: str,
+                           params: str,
+    ):
+        """
+        Send query to LLM, yields every query as soon as it is generated
+
+        With a validator every query is validated against its query model
+        before it is yielded, invalid queries are skipped.
+        """
+        validate = self._item_validator('queries')
+        for query in iter_stream_items(self.ask_stream(message, params),
+                                       'queries'):
+            if validate is not None:
+                try:
+                    validate(query)
+                except Exception as e:
+                    logger.error(f"Invalid streamed query skipped: {e}")
+                    logger.error(f"Query: {query}")
+                    continue
+            yield query
+
     def logs(self):
         """Download logs"""
         if self.flagging_dir:
@@ -276,28 +947,6 @@ class Server:
             return None
 
     def load_prompt_with_datetime(self):
-        """Load prompt from file and inject current GMT date/time placeholders."""
-        try:
-            with open('prompt.md', 'r', encoding='utf-8') as f:
-                prompt_content = f.read()
-
-            # Get current date/time in GMT
-            import datetime
-            current_datetime = datetime.datetime.now(datetime.timezone.utc)
-            current_date = current_datetime.strftime("%Y-%m-%d")
-            current_year = current_datetime.strftime("%Y")
-            current_datetime_full = current_datetime.strftime("%Y-%m-%d %H:%M:%S GMT")
-            
-            # Replace placeholders with actual values
-            prompt_content = prompt_content.replace('{datetime}', current_date)
-            prompt_content = prompt_content.replace('{year}', current_year)
-            prompt_content = prompt_content.replace('{datetime_full}', current_datetime_full)
-
-            logger.debug(f"Prompt content: {prompt_content}")
-            return prompt_content
-        except FileNotFoundError:
-            logger.warning("prompt.md not found, using default prompt")
-            return self.prompt
-        except Exception as e:
-            logger.error(f"Error loading prompt: {e}")
-            return self.prompt
+        """Return default prompt with current GMT date/time placeholders injected."""
+        # The prompt file is watched by the registry, nothing is read here
+        return self.prompt